@@ -1,30 +1,89 @@
+import os
+import sys
 from argparse import ArgumentParser
 from flask import Flask
 from flask_restful import Api
 
-from resources.endpoints import PlaceAutocomplete, Recommendations, PointToAddress
-from common.bing_maps import main_method
+from resources.endpoints import (PlaceAutocomplete, Recommendations, RecommendationsStream, PointToAddress, Metrics,
+                                 Liveness, Readiness)
+from common.bing_maps import main_method, get_default_bing_maps
+from common.response_cache import ResponseCache
+from common.warmup import Warmup
 
-app = Flask(__name__)
-api = Api(app)
+GUNICORN_CONFIG = os.path.abspath(os.path.join(os.path.dirname(__file__), "gunicorn.conf.py"))
 
 
-## setup the Api resource routing here
+def create_app(bing_maps=None, response_cache=None, warmup=None):
+    """
+    :param bing_maps: client shared by every request, defaults to the process wide client
+    :type bing_maps: BingMaps
+    :param response_cache: cache of whole /recommendations responses, a new one if not supplied
+    :type response_cache: ResponseCache
+    :param warmup: startup warmup whose state /readyz reports, a new one if not supplied
+    :type warmup: Warmup
+    :rtype: Flask
+    """
+    app = Flask(__name__)
+    api = Api(app)
 
-api.add_resource(PlaceAutocomplete, '/place_autocomplete/<query>')
-api.add_resource(PointToAddress, '/point_to_address/<query>')
-api.add_resource(Recommendations, '/recommendations')
+    # one client for the whole process, so that all requests share its caches and connection pool.
+    if bing_maps is None:
+        bing_maps = get_default_bing_maps()
+    resource_kwargs = {"bing_maps": bing_maps}
+
+    # repeated start/dest pairs are answered from here, and refreshed in the background once stale.
+    if response_cache is None:
+        response_cache = ResponseCache()
+    recommendations_kwargs = dict(resource_kwargs, response_cache=response_cache)
+
+    if warmup is None:
+        warmup = Warmup(bing_maps)
+
+    ## setup the Api resource routing here
+
+    api.add_resource(PlaceAutocomplete, '/place_autocomplete/<query>', resource_class_kwargs=resource_kwargs)
+    api.add_resource(PointToAddress, '/point_to_address/<query>', resource_class_kwargs=resource_kwargs)
+    api.add_resource(Recommendations, '/recommendations', resource_class_kwargs=recommendations_kwargs)
+    api.add_resource(RecommendationsStream, '/recommendations/stream', resource_class_kwargs=resource_kwargs)
+    api.add_resource(Metrics, '/metrics', resource_class_kwargs=recommendations_kwargs)
+    api.add_resource(Liveness, '/healthz')
+    api.add_resource(Readiness, '/readyz', resource_class_kwargs={"warmup": warmup})
+
+    return app
+
+
+# created on import, so that a preloading server shares them between its workers.
+bing_maps = get_default_bing_maps()
+response_cache = ResponseCache()
+warmup = Warmup(bing_maps)
+app = create_app(bing_maps, response_cache, warmup)
+
+
+def serve_production():
+    """
+    Serve the app with gunicorn, configured by gunicorn.conf.py: the app is loaded once, then forked into
+    multi-threaded workers that each warm up before they accept requests.
+    """
+    from gunicorn.app.wsgiapp import run
+
+    sys.argv = ["gunicorn", "--config", GUNICORN_CONFIG, "--chdir", os.path.dirname(GUNICORN_CONFIG), "app:app"]
+    run()
 
 
 if __name__ == '__main__':
     # python backend/app.py --help
     parser = ArgumentParser(description="Run the server or run tests by adding `--test`")
     parser.add_argument('--test', action='store_true', help="If flag is supplied, run tests instead of server")
+    parser.add_argument('--production', action='store_true',
+                        help="Serve with pre-forked gunicorn workers instead of the development server")
 
     args = parser.parse_args()
 
-    if not args.test:
-        app.run(debug=True)
-    else:
+    if args.test:
         # run tests here..... feel to comment as needed.
         main_method()
+    elif args.production:
+        serve_production()
+    else:
+        warmup.run()
+        app.run(debug=True)
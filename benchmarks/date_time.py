@@ -0,0 +1,108 @@
+# Parse and format a day's worth of transit timestamps with BingDateTime and with the eager implementation
+# it replaced. run python -m benchmarks.date_time from the root of the repo.
+
+import time
+import random
+import datetime
+from argparse import ArgumentParser
+
+from common.bing_maps import BingDateTime, BingDuration
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class EagerDateTime(object):
+    """
+        The previous BingDateTime: the datetime and its string are built for every timestamp.
+    """
+
+    def __init__(self, date_time):
+        self.date_time = date_time
+        date = self.date_time.strftime("%m/%d/%y")
+        time = self.date_time.strftime("%H:%M:%S")
+        self.date_time_str = date + " " + time
+
+    @staticmethod
+    def from_bing_api_time(time):
+        time = time.lstrip("/Date(").rstrip(")/")
+
+        if "-" in time:
+            seconds_from_epoch, offset = time.split("-")
+        elif "+" in time:
+            seconds_from_epoch, offset = time.split("+")
+        else:
+            seconds_from_epoch = time[:-4]
+            offset = time[-4:]
+
+        seconds_from_epoch = float(seconds_from_epoch) / 1000
+        offset = float(offset)
+
+        return EagerDateTime(datetime.datetime.fromtimestamp(seconds_from_epoch))
+
+    def __add__(self, duration):
+        return EagerDateTime(self.date_time + duration)
+
+
+def _get_api_times(num_times, seed):
+    # departures of every stop of a day of service, in the order a transit response lists them
+    rng = random.Random(seed)
+    midnight_ms = int(time.mktime(datetime.date.today().timetuple())) * 1000
+    return ["/Date({}-0700)/".format(midnight_ms + rng.randrange(DAY_MS)) for _ in range(num_times)]
+
+
+def _time(func, api_times):
+    start = time.perf_counter()
+    func(api_times)
+    return time.perf_counter() - start
+
+
+def _scenarios(cls, formatted_fraction):
+    duration = BingDuration(seconds=754)
+    every = max(int(round(1 / formatted_fraction)), 1) if formatted_fraction else 0
+
+    def parse(api_times):
+        for api_time in api_times:
+            cls.from_bing_api_time(api_time)
+
+    def parse_add(api_times):
+        # a transit route computes the end time of every truncated route
+        for api_time in api_times:
+            cls.from_bing_api_time(api_time) + duration
+
+    def parse_add_format(api_times):
+        # only the routes that make it into the response are formatted
+        for index, api_time in enumerate(api_times):
+            end_time = cls.from_bing_api_time(api_time) + duration
+            if every and index % every == 0:
+                end_time.date_time_str
+
+    return [("parse", parse), ("parse + add", parse_add),
+            ("parse + add + format {:.0%}".format(formatted_fraction), parse_add_format)]
+
+
+def run(num_times, formatted_fraction, seed=0):
+    api_times = _get_api_times(num_times, seed)
+
+    for api_time in api_times[:1000]:
+        eager, lazy = EagerDateTime.from_bing_api_time(api_time), BingDateTime.from_bing_api_time(api_time)
+        assert eager.date_time_str == lazy.date_time_str, (eager.date_time_str, lazy.date_time_str)
+
+    print("{} timestamps".format(num_times))
+    for (name, eager), (_, lazy) in zip(_scenarios(EagerDateTime, formatted_fraction),
+                                        _scenarios(BingDateTime, formatted_fraction)):
+        eager_secs, lazy_secs = _time(eager, api_times), _time(lazy, api_times)
+        print("{:<28} eager {:>8.3f}s lazy {:>8.3f}s  {:>5.1f}x"
+              .format(name, eager_secs, lazy_secs, eager_secs / lazy_secs))
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark BingDateTime against the eager implementation it replaced")
+    parser.add_argument('--times', type=int, default=200000, help="number of timestamps")
+    parser.add_argument('--formatted', type=float, default=0.2, help="fraction of the end times that are formatted")
+    args = parser.parse_args()
+
+    run(args.times, args.formatted)
+
+
+if __name__ == '__main__':
+    main()
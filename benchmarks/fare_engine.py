@@ -0,0 +1,54 @@
+# Compare the scalar fare estimates with the batched fare engine.
+# run python -m benchmarks.fare_engine from the root of the repo.
+
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from common.fare_engine import estimate_fares, RIDESHARE_ESTIMATES
+
+
+def _scalar_fares(distances, durations):
+    return {estimate.name: [estimate.estimate_fare(distance, duration)
+                            for distance, duration in zip(distances, durations)]
+            for estimate in RIDESHARE_ESTIMATES}
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def run(num_legs, seed=0):
+    rng = np.random.default_rng(seed)
+    distances = rng.uniform(0.1, 60.0, num_legs)
+    durations = rng.uniform(60.0, 2 * 60 * 60, num_legs)
+
+    vector_secs, vector_fares = _time(estimate_fares, distances, durations)
+
+    distance_list, duration_list = distances.tolist(), durations.tolist()
+    scalar_secs, scalar_fares = _time(_scalar_fares, distance_list, duration_list)
+
+    for name, fares in scalar_fares.items():
+        if not np.array_equal(np.asarray(fares), vector_fares[name]):
+            raise AssertionError("Batched {} fares differ from the scalar estimate.".format(name))
+
+    return scalar_secs, vector_secs
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark scalar vs batched rideshare fare estimates")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 10000000],
+                        help="number of legs to price")
+    args = parser.parse_args()
+
+    print("{:>10} {:>12} {:>12} {:>9}".format("legs", "scalar (s)", "batched (s)", "speedup"))
+    for size in args.sizes:
+        scalar_secs, vector_secs = run(size)
+        print("{:>10} {:>12.4f} {:>12.4f} {:>8.1f}x".format(size, scalar_secs, vector_secs, scalar_secs / vector_secs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+# End to end latency benchmark of the /recommendations pipeline against the Bing stub server.
+# run python -m benchmarks.recommendations --help from the root of the repo.
+
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_server import BingStubServer
+
+DEFAULT_CORPUS = [
+    ["alki beach", "university of washington"],
+    ["space needle", "microsoft building 18"],
+    ["pike place market", "seattle tacoma international airport"],
+    ["ballard locks", "capitol hill station"],
+    ["green lake", "pioneer square"],
+    ["fremont troll", "columbia center"],
+    ["discovery park", "t-mobile park"],
+    ["northgate mall", "seattle central library"],
+    ["47.6205,-122.3493", "47.6553,-122.3035"],
+    ["47.5763,-122.4096", "47.6097,-122.3422"],
+]
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(int(round(percent / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else None,
+        "p50_ms": 1000 * _percentile(latencies, 50) if latencies else None,
+        "p95_ms": 1000 * _percentile(latencies, 95) if latencies else None,
+        "p99_ms": 1000 * _percentile(latencies, 99) if latencies else None,
+        "max_ms": 1000 * latencies[-1] if latencies else None,
+    }
+
+
+def _request_body(start, dest, max_routes):
+    body = {"start": start, "dest": dest, "optimise_for": "time"}
+    if max_routes is not None:
+        body["max_routes"] = max_routes
+    return body
+
+
+class InProcessClient(object):
+    """
+        Calls Recommendations.post through the Flask test client, no network between client and server.
+    """
+
+    def __init__(self, app, max_routes=None):
+        self.app = app
+        self.max_routes = max_routes
+
+    def recommend(self, start, dest):
+        with self.app.test_client() as client:
+            response = client.post('/recommendations', json=_request_body(start, dest, self.max_routes))
+            if response.status_code != 200:
+                raise RuntimeError("/recommendations returned {}".format(response.status_code))
+            return response.get_json()
+
+
+class HttpClient(object):
+    """
+        Calls /recommendations over HTTP on a threaded werkzeug server running the app.
+    """
+
+    def __init__(self, app, max_routes=None):
+        import requests
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self._server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.url = "http://127.0.0.1:{}/recommendations".format(self._server.server_port)
+        self._local = threading.local()
+        self._requests = requests
+        self.max_routes = max_routes
+
+    def recommend(self, start, dest):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+
+        response = session.post(self.url, json=_request_body(start, dest, self.max_routes))
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self._server.shutdown()
+
+
+def measure_latency(client, corpus, stub, clear_caches, repeat, cold):
+    """
+    Sequential requests, so that the upstream calls of each request can be counted exactly.
+    """
+    latencies = []
+    upstream_calls = []
+    for _ in range(repeat):
+        for start, dest in corpus:
+            if cold:
+                clear_caches()
+            calls_before = stub.request_count
+
+            request_start = time.perf_counter()
+            client.recommend(start, dest)
+            latencies.append(time.perf_counter() - request_start)
+
+            upstream_calls.append(stub.request_count - calls_before)
+
+    result = _summarize(latencies)
+    result["upstream_calls_per_request"] = float(sum(upstream_calls)) / len(upstream_calls)
+    result["max_upstream_calls_per_request"] = max(upstream_calls)
+    return result
+
+
+def measure_throughput(client, corpus, clear_caches, concurrency, num_requests, cold):
+    """
+    Requests are sent in rounds of `concurrency` concurrent requests. When cold, the caches are cleared before
+    every round, so that the requests of a round only share the upstream calls they make at the same time.
+    """
+    requests_to_send = [corpus[index % len(corpus)] for index in range(num_requests)]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def _send(start_dest):
+        request_start = time.perf_counter()
+        try:
+            client.recommend(*start_dest)
+        except Exception:
+            with lock:
+                errors[0] += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - request_start)
+
+    elapsed = 0.0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if not cold:
+            start = time.perf_counter()
+            list(executor.map(_send, requests_to_send))
+            elapsed = time.perf_counter() - start
+        else:
+            for index in range(0, num_requests, concurrency):
+                clear_caches()
+                start = time.perf_counter()
+                list(executor.map(_send, requests_to_send[index:index + concurrency]))
+                elapsed += time.perf_counter() - start
+
+    result = _summarize(latencies)
+    result.update({"concurrency": concurrency, "requests_per_sec": num_requests / elapsed, "errors": errors[0],
+                   "warm": not cold})
+    return result
+
+
+def measure_allocations(client, corpus, clear_caches, cold):
+    peaks = []
+    blocks = []
+
+    tracemalloc.start()
+    try:
+        for start, dest in corpus:
+            if cold:
+                clear_caches()
+            tracemalloc.reset_peak()
+            current_before = tracemalloc.get_traced_memory()[0]
+            blocks_before = sys.getallocatedblocks()
+
+            client.recommend(start, dest)
+
+            peaks.append(tracemalloc.get_traced_memory()[1] - current_before)
+            blocks.append(sys.getallocatedblocks() - blocks_before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "mean_peak_kib_per_request": sum(peaks) / len(peaks) / 1024.0,
+        "max_peak_kib_per_request": max(peaks) / 1024.0,
+        "mean_retained_blocks_per_request": float(sum(blocks)) / len(blocks),
+    }
+
+
+def run_suite(client, corpus, stub, clear_caches, args):
+    return {
+        "latency": measure_latency(client, corpus, stub, clear_caches, args.repeat, not args.warm),
+        "throughput": measure_throughput(client, corpus, clear_caches, args.concurrency, args.requests,
+                                         not args.warm),
+        "allocations": measure_allocations(client, corpus, clear_caches, not args.warm),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    :return: list of metrics that are more than `tolerance` worse than in the baseline report
+    """
+    regressions = []
+    for mode, suites in report["results"].items():
+        for metric, higher_is_better in [("latency.p95_ms", False), ("latency.upstream_calls_per_request", False),
+                                         ("throughput.requests_per_sec", True),
+                                         ("allocations.mean_peak_kib_per_request", False)]:
+            suite, name = metric.split(".")
+            try:
+                old, new = baseline["results"][mode][suite][name], suites[suite][name]
+            except KeyError:
+                continue
+            if old is None or new is None:
+                continue
+            worse = new < old * (1 - tolerance) if higher_is_better else new > old * (1 + tolerance)
+            if worse:
+                regressions.append("{} {}: {:.2f} -> {:.2f}".format(mode, metric, old, new))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark /recommendations end to end against a stubbed Bing backend")
+    parser.add_argument('--corpus', help="json file with a list of [start, dest] pairs")
+    parser.add_argument('--mode', choices=["in-process", "http", "both"], default="both")
+    parser.add_argument('--repeat', type=int, default=3, help="passes over the corpus for the latency measurement")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent clients for the throughput measurement")
+    parser.add_argument('--requests', type=int, default=100, help="requests sent for the throughput measurement")
+    parser.add_argument('--warm', action='store_true', help="keep the caches between requests")
+    parser.add_argument('--max-routes', type=int, help="ask for the top K transit and hybrid routes only")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds of latency of every stubbed Bing call")
+    parser.add_argument('--latency-jitter', type=float, default=0.01, help="random extra seconds per Bing call")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of stubbed Bing calls that fail")
+    parser.add_argument('--output', help="write the json report to this file")
+    parser.add_argument('--compare', help="json report of a previous run, exit with 1 if a metric regressed")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed relative regression when comparing")
+    args = parser.parse_args()
+
+    corpus = DEFAULT_CORPUS
+    if args.corpus:
+        with open(args.corpus, 'r') as corpus_file:
+            corpus = json.load(corpus_file)
+
+    stub = BingStubServer(latency=args.latency, latency_jitter=args.latency_jitter, error_rate=args.error_rate).start()
+    os.environ["BING_MAPS_URL"] = stub.base_url
+
+    import app as server  # after BING_MAPS_URL is set, so that the app talks to the stub
+
+    def clear_caches():
+        server.bing_maps.clear_caches()
+        server.response_cache.clear()
+
+    modes = ["in-process", "http"] if args.mode == "both" else [args.mode]
+    results = {}
+    for mode in modes:
+        clear_caches()
+        if mode == "in-process":
+            client = InProcessClient(server.app, args.max_routes)
+        else:
+            client = HttpClient(server.app, args.max_routes)
+        try:
+            results[mode] = run_suite(client, corpus, stub, clear_caches, args)
+        finally:
+            if mode == "http":
+                client.close()
+
+    stub.stop()
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "corpus_size": len(corpus),
+            "stub": {"latency": args.latency, "latency_jitter": args.latency_jitter, "error_rate": args.error_rate},
+            "warm": args.warm,
+            "max_routes": args.max_routes,
+        },
+        "results": results,
+    }
+
+    report_json = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(report_json)
+    print(report_json)
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Memory and construction time of the Bing route model, built from realistic transit responses.
+# run python -m benchmarks.route_model from the root of the repo.
+
+import sys
+import json
+import time
+import random
+import datetime
+import tracemalloc
+from argparse import ArgumentParser
+
+from benchmarks.stub_server import SyntheticBing, CENTER, SPREAD
+from common.bing_maps import (BingMaps, BingDateTime, BingDistance, BingDuration, BingWalkSegment,
+                              BingTransportSegment, RideShareRoute, BingComplexRoute, _get_transit_route_points,
+                              _quantize_point)
+from common.optimizer import RouteOptimizer
+
+
+def _parsed(response):
+    # a fresh copy, as if it had just been read from the network
+    return json.loads(json.dumps(response))
+
+
+def _get_requests(num_requests, max_solutions, seed):
+    synthetic = SyntheticBing()
+    rng = random.Random(seed)
+    depart = datetime.datetime.now().strftime("%m/%d/%y %H:%M:%S")
+
+    requests = []
+    for _ in range(num_requests):
+        source, dest = ["{:.6f},{:.6f}".format(CENTER[0] + rng.uniform(-SPREAD, SPREAD),
+                                               CENTER[1] + rng.uniform(-SPREAD, SPREAD)) for _ in range(2)]
+        params = {"wayPoint.1": source, "wayPoint.2": dest, "dateTime": depart, "maxSolutions": max_solutions}
+        routes = _parsed(synthetic.transit(params))["resourceSets"][0]["resources"]
+        requests.append((routes, [(point, _parsed(synthetic.locations_point(point)))
+                                  for point in _get_transit_route_points(routes)]))
+    return requests
+
+
+def _build(bing_maps, routes, located_points, known_locations):
+    """
+    :return: the transit routes of a response and the hybrid routes built from them, as the server builds them
+    """
+    locations = {}
+    for point, response_dict in located_points:
+        key = _quantize_point(point[0], point[1], bing_maps.point_precision)
+        if key not in known_locations:
+            # the reverse geocode cache shares one location per point between requests
+            known_locations[key] = bing_maps._parse_location_from_point(response_dict, point[0], point[1])
+        locations[key] = known_locations[key]
+
+    transit_routes = bing_maps._build_transit_routes(routes, locations, BingDateTime.now())
+
+    complex_routes = []
+    for transit_route in transit_routes:
+        for prefix_route, rs_source, rs_depart_time in RouteOptimizer._get_hybrid_candidates(transit_route):
+            ride_share_routes = RideShareRoute.from_distance_duration(rs_source, transit_route.end_location,
+                                                                      BingDistance(3.2, "mile"),
+                                                                      BingDuration(seconds=720), rs_depart_time)
+            complex_routes.append(BingComplexRoute([prefix_route, ride_share_routes["uber"]]))
+    return transit_routes, complex_routes
+
+
+def _instance_size(obj):
+    return sys.getsizeof(obj) + (sys.getsizeof(obj.__dict__) if hasattr(obj, "__dict__") else 0)
+
+
+def _print_instance_sizes(transit_routes, complex_routes):
+    segments = list(transit_routes[0].segments)
+    walk = next(segment for segment in segments if isinstance(segment, BingWalkSegment))
+    transport = next(segment for segment in segments if isinstance(segment, BingTransportSegment))
+    samples = [
+        ("BingDateTime", transport.depart_details.time),
+        ("BingDuration", transport.duration),
+        ("BingLocation", transit_routes[0].start_location),
+        ("BingDepartArrive", transport.depart_details),
+        ("BingWalkSegment", walk),
+        ("BingTransportSegment", transport),
+        ("BingTransitRoute", transit_routes[0]),
+        ("RideShareRoute", complex_routes[0].routes[-1]),
+        ("BingComplexRoute", complex_routes[0]),
+    ]
+    for name, obj in samples:
+        print("{:<22} {:>5} bytes".format(name, _instance_size(obj)))
+
+
+def run(num_requests, max_solutions, seed=0):
+    bing_maps = BingMaps(api_key="benchmark")
+    requests = _get_requests(num_requests, max_solutions, seed)
+    known_locations = {}
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    built = [_build(bing_maps, routes, located_points, known_locations) for routes, located_points in requests]
+    build_secs = time.perf_counter() - start
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    num_transit = sum(len(transit_routes) for transit_routes, _ in built)
+    num_complex = sum(len(complex_routes) for _, complex_routes in built)
+    print("{} requests, {} transit routes, {} hybrid routes, {} distinct locations"
+          .format(num_requests, num_transit, num_complex, len(known_locations)))
+    print("retained    {:>10.1f} KiB per request".format(retained / 1024.0 / num_requests))
+    print("build       {:>10.3f} ms per request".format(1000 * build_secs / num_requests))
+
+    # construction time without the tracing overhead
+    known_locations = {}
+    start = time.perf_counter()
+    for routes, located_points in requests:
+        _build(bing_maps, routes, located_points, known_locations)
+    print("build       {:>10.3f} ms per request, untraced".format(1000 * (time.perf_counter() - start) / num_requests))
+
+    print("")
+    _print_instance_sizes(*built[0])
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the memory and construction time of the route model")
+    parser.add_argument('--requests', type=int, default=500, help="number of transit responses")
+    parser.add_argument('--max-solutions', type=int, default=4, help="transit routes per response")
+    args = parser.parse_args()
+
+    run(args.requests, args.max_solutions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Bulk load, incremental insert and nearest neighbour benchmarks of the spatial index of known addresses.
+# run python -m benchmarks.spatial_index from the root of the repo.
+
+import time
+import random
+from argparse import ArgumentParser
+
+from common.bing_maps import BingLocation
+from common.spatial_index import SpatialIndex
+
+# roughly the Seattle metro area
+LAT_RANGE = (47.40, 47.80)
+LONG_RANGE = (-122.45, -122.10)
+
+
+def _random_points(rng, num_points):
+    return [(rng.uniform(*LAT_RANGE), rng.uniform(*LONG_RANGE)) for _ in range(num_points)]
+
+
+def _rate(count, seconds):
+    return "{:>10.0f}/s".format(count / seconds)
+
+
+def run(num_points, num_inserts, num_queries, radius, seed=0):
+    rng = random.Random(seed)
+    points = _random_points(rng, num_points)
+    locations = [(latitude, longitude, BingLocation([latitude, longitude], "address {}".format(i)))
+                 for i, (latitude, longitude) in enumerate(points)]
+
+    index = SpatialIndex(max_points=num_points + num_inserts, max_inserted=max(num_inserts, 1))
+
+    start = time.perf_counter()
+    index.bulk_load(locations)
+    load_secs = time.perf_counter() - start
+    print("bulk load   {:>9} points {:>8.2f}s {}".format(num_points, load_secs, _rate(num_points, load_secs)))
+
+    inserts = _random_points(rng, num_inserts)
+    start = time.perf_counter()
+    for latitude, longitude in inserts:
+        index.insert(latitude, longitude, BingLocation([latitude, longitude], "inserted"))
+    insert_secs = time.perf_counter() - start
+    print("insert      {:>9} points {:>8.2f}s {}".format(num_inserts, insert_secs, _rate(num_inserts, insert_secs)))
+
+    # half of the queries are next to a known point, half are random
+    queries = [(latitude + 0.00003, longitude) for latitude, longitude in rng.sample(points, num_queries // 2)]
+    queries.extend(_random_points(rng, num_queries - len(queries)))
+
+    start = time.perf_counter()
+    found = sum(1 for latitude, longitude in queries if index.nearest(latitude, longitude, radius) is not None)
+    query_secs = time.perf_counter() - start
+    print("nearest     {:>9} queries {:>7.2f}s {} ({} within {}m)"
+          .format(num_queries, query_secs, _rate(num_queries, query_secs), found, radius))
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the spatial index of known addresses")
+    parser.add_argument('--points', type=int, default=1000000, help="number of bulk loaded points")
+    parser.add_argument('--inserts', type=int, default=100000, help="number of incremental inserts")
+    parser.add_argument('--queries', type=int, default=100000, help="number of nearest neighbour queries")
+    parser.add_argument('--radius', type=float, default=10, help="search radius in meters")
+    args = parser.parse_args()
+
+    run(args.points, args.inserts, args.queries, args.radius)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+# Deterministic stand-in for the Bing Maps REST services, for load testing without network access or quota.
+# run python -m benchmarks.stub_server --help from the root of the repo, then start the server with
+# BING_MAPS_URL=http://127.0.0.1:<port>/REST/v1 so that BingMaps talks to the stub.
+
+import json
+import math
+import time
+import random
+import hashlib
+import datetime
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+from common.replay import get_request_path, load_recording
+
+# synthetic locations are spread over roughly the Seattle metro area
+CENTER = (47.60, -122.33)
+SPREAD = 0.15
+DRIVING_SPEED = 25.0  # miles per hour
+MILES_PER_DEGREE = 69.0
+
+
+def _seed(*values):
+    return int(hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()[:12], 16)
+
+
+def _point_for_query(query, index=0):
+    rng = random.Random(_seed(query.lower(), index))
+    return [round(CENTER[0] + rng.uniform(-SPREAD, SPREAD), 6), round(CENTER[1] + rng.uniform(-SPREAD, SPREAD), 6)]
+
+
+def _parse_point(value):
+    try:
+        latitude, longitude = [float(coord) for coord in value.split(",")]
+        return [latitude, longitude]
+    except ValueError:
+        # transit waypoints are addresses
+        return _point_for_query(value)
+
+
+def _miles_between(source, dest):
+    x = (dest[1] - source[1]) * math.cos(math.radians((source[0] + dest[0]) / 2))
+    y = dest[0] - source[0]
+    return math.sqrt(x * x + y * y) * MILES_PER_DEGREE * 1.3  # roads are not straight
+
+
+def _location_resource(point, address, confidence="High"):
+    return {
+        "point": {"type": "Point", "coordinates": point},
+        "address": {"formattedAddress": address},
+        "confidence": confidence
+    }
+
+
+def _response(resources):
+    return {"statusCode": 200, "resourceSets": [{"estimatedTotal": len(resources), "resources": resources}]}
+
+
+def _bing_time(epoch_secs):
+    return "/Date({}-0700)/".format(int(epoch_secs * 1000))
+
+
+class SyntheticBing(object):
+    """
+        Builds plausible and deterministic Bing responses: the same request always gets the same response.
+    """
+
+    def locations_query(self, params):
+        query = params.get("query", "")
+        confidences = ["High", "Medium", "Medium", "Low", "Low"]
+        return _response([_location_resource(_point_for_query(query, index),
+                                             "{} {}, Seattle, WA".format(query.title(), index + 1), confidence)
+                          for index, confidence in enumerate(confidences)])
+
+    def locations_point(self, point):
+        number = _seed(round(point[0], 4), round(point[1], 4)) % 9000 + 100
+        return _response([_location_resource(point, "{} Synthetic Ave, Seattle, WA 98101".format(number))])
+
+    def driving(self, params):
+        source, dest = _parse_point(params["waypoint.0"]), _parse_point(params["waypoint.1"])
+        miles = _miles_between(source, dest) + 0.2
+        return _response([{
+            "distanceUnit": "Mile",
+            "durationUnit": "Second",
+            "travelDistance": round(miles, 3),
+            "travelDuration": int(miles / DRIVING_SPEED * 3600) + 60,
+            "travelDurationTraffic": int(miles / DRIVING_SPEED * 3600 * 1.2) + 60
+        }])
+
+    def distance_matrix(self, params):
+        dest = _parse_point(params["destinations"].split(";")[0])
+        results = []
+        for index, origin in enumerate(params["origins"].split(";")):
+            miles = _miles_between(_parse_point(origin), dest) + 0.2
+            results.append({"originIndex": index, "destinationIndex": 0, "travelDistance": round(miles, 3),
+                            "travelDuration": int(miles / DRIVING_SPEED * 3600) + 60})
+        return _response([{"results": results}])
+
+    def transit(self, params):
+        source, dest = _parse_point(params["wayPoint.1"]), _parse_point(params["wayPoint.2"])
+        try:
+            depart = time.mktime(datetime.datetime.strptime(params["dateTime"], "%m/%d/%y %H:%M:%S").timetuple())
+        except (KeyError, ValueError):
+            depart = time.time()
+
+        rng = random.Random(_seed(source, dest))
+        routes = [self._transit_route(rng, source, dest, depart, solution)
+                  for solution in range(int(params.get("maxSolutions", 4)))]
+        return _response(routes)
+
+    def _transit_route(self, rng, source, dest, depart, solution):
+        num_rides = 1 + (solution % 3)
+        stops = [source]
+        for ride in range(num_rides * 2):
+            fraction = float(ride + 1) / (num_rides * 2 + 1)
+            stops.append([round(source[0] + (dest[0] - source[0]) * fraction + rng.uniform(-0.01, 0.01), 6),
+                          round(source[1] + (dest[1] - source[1]) * fraction + rng.uniform(-0.01, 0.01), 6)])
+
+        items = []
+        clock = depart
+        walk = lambda point, secs: {
+            "iconType": "Walk",
+            "maneuverPoint": {"coordinates": point},
+            "details": [{"maneuverType": "Walk"}],
+            "instruction": {"text": "Walk to stop"},
+            "travelDistance": round(secs / 1200.0, 3),
+            "travelDuration": secs
+        }
+
+        for ride in range(num_rides):
+            board, alight = stops[ride * 2 + 1], stops[ride * 2 + 2]
+            walk_secs = rng.randint(60, 600)
+            items.append(walk(stops[ride * 2], walk_secs))
+            clock += walk_secs + rng.randint(0, 300)
+
+            ride_secs = int(_miles_between(board, alight) / 15.0 * 3600) + 120
+            items.append({
+                "iconType": "Bus",
+                "details": [{"maneuverType": "TakeTransit"}],
+                "instruction": {"text": "Bus {}".format(rng.randint(1, 599))},
+                "travelDistance": round(_miles_between(board, alight), 3),
+                "travelDuration": ride_secs,
+                "transitLine": {"agencyName": rng.choice(["King County Metro", "Sound Transit"])},
+                "childItineraryItems": [
+                    {"time": _bing_time(clock), "details": [{"maneuverType": "TransitDepart"}],
+                     "instruction": {"text": "Depart stop"}, "maneuverPoint": {"coordinates": board}},
+                    {"time": _bing_time(clock + ride_secs), "details": [{"maneuverType": "TransitArrive"}],
+                     "instruction": {"text": "Arrive stop"}, "maneuverPoint": {"coordinates": alight}}
+                ]
+            })
+            clock += ride_secs
+
+        last_walk = rng.randint(60, 600)
+        items.append(walk(stops[-1], last_walk))
+        clock += last_walk
+
+        return {
+            "durationUnit": "Second",
+            "distanceUnit": "Mile",
+            "travelDuration": int(clock - depart),
+            "routeLegs": [{
+                "actualStart": {"coordinates": source},
+                "actualEnd": {"coordinates": dest},
+                "itineraryItems": items
+            }]
+        }
+
+    def respond(self, path, params):
+        lowered = path.lower()
+        if lowered == "/locations":
+            return self.locations_query(params)
+        if lowered.startswith("/locations/"):
+            return self.locations_point(_parse_point(path.split("/")[-1]))
+        if lowered == "/routes/transit":
+            return self.transit(params)
+        if lowered == "/routes/driving":
+            return self.driving(params)
+        if lowered == "/routes/distancematrix":
+            return self.distance_matrix(params)
+        return None
+
+
+class BingStubServer(object):
+    """
+        Local HTTP server answering Bing Maps requests from recorded responses (see common.replay) and, optionally,
+        synthetic ones, with injected latency and errors.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, recording_dir=None, synthetic=True, latency=0.0,
+                 latency_jitter=0.0, error_rate=0.0, seed=0):
+        """
+        :param port: port to listen on, 0 picks a free one
+        :param recording_dir: directory of recorded responses, checked before the synthetic responses
+        :param synthetic: answer requests that were not recorded with synthetic responses instead of 404s
+        :param latency: seconds added to every response
+        :param latency_jitter: up to that many extra seconds, uniformly distributed
+        :param error_rate: fraction of the requests answered with a 503
+        """
+        self.recording_dir = recording_dir
+        self.synthetic = SyntheticBing() if synthetic else None
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.error_count = 0
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._server = ThreadingHTTPServer((host, port), self._get_handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}/REST/v1".format(host, port)
+
+    def _get_handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like Bing
+
+            def do_GET(self):
+                status, body = stub.handle(self.path)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, raw_path):
+        """
+        :return: (status code, body) for the request
+        """
+        split_url = urlsplit(raw_path)
+        path = get_request_path(split_url.path)
+        params = dict(parse_qsl(split_url.query))
+
+        with self._lock:
+            self.request_count += 1
+            delay = self.latency + self._rng.uniform(0, self.latency_jitter)
+            is_error = self._rng.random() < self.error_rate
+            if is_error:
+                self.error_count += 1
+
+        if delay:
+            time.sleep(delay)
+
+        if is_error:
+            return 503, {"statusCode": 503, "errorDetails": ["Injected error."], "resourceSets": []}
+
+        body = load_recording(self.recording_dir, split_url.path, params) if self.recording_dir else None
+        if body is None and self.synthetic:
+            body = self.synthetic.respond(path, params)
+        if body is None:
+            return 404, {"statusCode": 404, "errorDetails": ["No response for {}.".format(path)], "resourceSets": []}
+        return 200, body
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.error_count = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+
+def main():
+    parser = ArgumentParser(description="Serve recorded or synthetic Bing Maps responses")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--recordings', help="directory of responses recorded with BING_MAPS_RECORD_DIR")
+    parser.add_argument('--no-synthetic', action='store_true', help="answer requests that were not recorded with 404s")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="random extra seconds per response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with a 503")
+    args = parser.parse_args()
+
+    server = BingStubServer(args.host, args.port, recording_dir=args.recordings, synthetic=not args.no_synthetic,
+                            latency=args.latency, latency_jitter=args.latency_jitter, error_rate=args.error_rate)
+    print("Serving Bing stand-in at {}".format(server.base_url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+import asyncio
+import functools
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from common import metrics
+from common import rate_limit
+from common.autocomplete import normalize_query
+from common.bing_maps import (BingApiError, BingDateTime, BingDrivingRoute, get_default_bing_maps,
+                              _get_transit_route_points, _select_transit_routes, _quantize_point,
+                              _location_to_persisted, _location_from_persisted, _driving_leg_to_persisted,
+                              _driving_leg_from_persisted, DEFAULT_MATRIX_MAX_ORIGINS)
+from common.singleflight import AsyncSingleFlight
+from common.transport import BingTransport, DEFAULT_TIMEOUT, RETRY_STATUS_CODES
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed for the asyncio client
+    aiohttp = None
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_BLOCKING_WORKERS = 4  # threads running the persistent cache and the record/replay transports
+
+
+class AsyncBingMaps(object):
+    """
+        asyncio version of BingMaps with the same public methods, built on aiohttp.
+
+        It wraps a BingMaps client and shares its key, settings, caches, including its persistent cache, and
+        rate limiter, so the sync and async clients of a process never resolve the same point twice. Like
+        the sync client, it coalesces concurrent identical calls of its tasks. Create and use it inside a
+        running event loop and `await close()` it when done.
+
+        Nothing blocks the event loop: the persistent cache, and the transport of a client that records or
+        replays Bing responses, are used from a small thread pool, and calls waiting for the rate limiter wait
+        in a pool of their own, so that they never hold up the other blocking work.
+    """
+
+    def __init__(self, bing_maps=None, max_connections=DEFAULT_MAX_CONNECTIONS, singleflight=None):
+        """
+        :param bing_maps: client whose key, settings and caches are shared, defaults to the process wide client
+        :type bing_maps: BingMaps
+        :param max_connections: maximum number of simultaneous connections to Bing
+        :type max_connections: int
+        :param singleflight: coalesces concurrent identical point lookups, geocode queries and driving routes
+        :type singleflight: AsyncSingleFlight
+        """
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for AsyncBingMaps, run `pip install aiohttp`.")
+
+        self.bing_maps = bing_maps or get_default_bing_maps()
+        self.max_connections = max_connections
+        self.singleflight = AsyncSingleFlight() if singleflight is None else singleflight
+        self._session = None
+        self._blocking_executor = None
+        self._rate_limit_executor = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        for executor in (self._blocking_executor, self._rate_limit_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        self._blocking_executor = None
+        self._rate_limit_executor = None
+
+    def _get_blocking_executor(self):
+        if self._blocking_executor is None:
+            self._blocking_executor = ThreadPoolExecutor(max_workers=DEFAULT_BLOCKING_WORKERS,
+                                                         thread_name_prefix="bing-async-blocking")
+        return self._blocking_executor
+
+    async def _run_blocking(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._get_blocking_executor(), function, *args)
+
+    def _persist(self, namespace, key, value):
+        # nobody waits for the write, a compaction it triggers only holds up a pool thread
+        self._get_blocking_executor().submit(self.bing_maps.persistent_cache.set, namespace, key, value)
+
+    def coalescing_stats(self):
+        """
+        :return: number of Bing calls made and saved by sharing identical calls in flight, see SingleFlight.stats
+        :rtype: dict
+        """
+        return self.singleflight.stats()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _get_json(self, endpoint, url, params):
+        if self.bing_maps.rate_limiter is not None:
+            # the limiter blocks while waiting for a token, up to one waiting thread per connection
+            if self._rate_limit_executor is None:
+                self._rate_limit_executor = ThreadPoolExecutor(max_workers=self.max_connections,
+                                                               thread_name_prefix="bing-async-rate-limit")
+            # the priority is read from this task's context
+            await asyncio.get_running_loop().run_in_executor(self._rate_limit_executor, self.bing_maps._acquire_call,
+                                                             endpoint, rate_limit.get_call_priority(endpoint))
+
+        with metrics.time_upstream_call(endpoint) as call:
+            return await self._get_json_with_retries(endpoint, url, params, call)
+
+    async def _get_json_with_retries(self, endpoint, url, params, call):
+        """
+        :param call: outcome of the call, marked as failed for an error status
+        :type call: metrics.UpstreamCall
+        """
+        transport = self.bing_maps.transport
+        if not isinstance(transport, BingTransport):
+            # a client that records or replays responses, aiohttp would bypass its transport
+            return await self._get_json_from_transport(transport, endpoint, url, params, call)
+
+        connect_timeout, read_timeout = transport.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+        attempt = 0
+        while True:
+            try:
+                async with self._get_session().get(url, params=params, timeout=timeout) as response:
+                    if response.status not in RETRY_STATUS_CODES or attempt >= transport.max_retries:
+                        call.failed = response.status >= 400
+                        return await response.json(content_type=None)
+                    delay = transport._backoff(attempt, response.headers.get("Retry-After"))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= transport.max_retries:
+                    raise BingApiError("Error calling the Bing Maps API: {}".format(e))
+                delay = transport._backoff(attempt)
+            except (aiohttp.ClientError, ValueError):
+                raise BingApiError("The Bing Maps API returned an invalid response for '{}'.".format(url))
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _get_json_from_transport(self, transport, endpoint, url, params, call):
+        try:
+            response = await self._run_blocking(transport.get, endpoint, url, params)
+            call.failed = response.status_code >= 400
+            return response.json()
+        except requests.RequestException as e:
+            raise BingApiError("Error calling the Bing Maps API: {}".format(e))
+        except ValueError:
+            raise BingApiError("The Bing Maps API returned an invalid response for '{}'.".format(url))
+
+    async def _get_locations_for_query(self, location_str):
+        # the returned location resources are shared by the concurrent callers, who must not modify them
+        return await self.singleflight.do("locations_query", normalize_query(location_str),
+                                          functools.partial(self._fetch_locations_for_query, location_str))
+
+    async def _fetch_locations_for_query(self, location_str):
+        persistent_cache = self.bing_maps.persistent_cache
+        if persistent_cache is not None:
+            locations = await self._run_blocking(persistent_cache.get, "locations_query", normalize_query(location_str))
+            if locations is not None:
+                return locations
+
+        response_dict = await self._get_json(*self.bing_maps._locations_query_request(location_str))
+        locations = self.bing_maps._parse_locations_for_query(response_dict, location_str)
+        if persistent_cache is not None and locations:
+            self._persist("locations_query", normalize_query(location_str), locations)
+        return locations
+
+    async def get_location_from_string(self, location_str):
+        """
+        :rtype: BingLocation
+        :raises: BingApiError if no valid location was returned
+        """
+        locations = await self._get_locations_for_query(location_str)
+        return self.bing_maps._location_from_query_results(locations, location_str)
+
+    async def get_possible_locations_from_string(self, location_str):
+        """
+        :rtype: [BingLocation, confidence_as_int]
+        :raises: BingApiError if no valid location was returned
+        """
+        results = self.bing_maps.autocomplete_cache.get(location_str)
+        if results is None:
+            locations = await self._get_locations_for_query(location_str)
+            results = self.bing_maps._possible_locations_from_query_results(locations)
+            self.bing_maps.autocomplete_cache.set(location_str, results)
+        return results
+
+    async def get_location_from_point(self, latitude, longitude):
+        """
+        :rtype: BingLocation
+        :raises: BingApiError if no valid location was returned
+        """
+        point = _quantize_point(latitude, longitude, self.bing_maps.point_precision)
+
+        location = self.bing_maps._get_known_location(point)
+        if location is None:
+            location = await self._lookup_point(point)
+        return location
+
+    async def _lookup_point(self, point):
+        return await self.singleflight.do("locations_point", point, functools.partial(self._fetch_point, point))
+
+    async def _fetch_point(self, point):
+        persistent_cache = self.bing_maps.persistent_cache
+        location = None
+        if persistent_cache is not None:
+            value = await self._run_blocking(persistent_cache.get, "locations_point", point)
+            if value is not None:
+                location = _location_from_persisted(value)
+
+        if location is None:
+            response_dict = await self._get_json(*self.bing_maps._location_point_request(*point))
+            location = self.bing_maps._parse_location_from_point(response_dict, *point)
+            if persistent_cache is not None:
+                self._persist("locations_point", point, _location_to_persisted(location))
+
+        self.bing_maps._remember_location(point, location)
+        return location
+
+    async def get_locations_from_points(self, points):
+        """
+        Resolve many points at once, every point missing from the reverse geocode cache is looked up concurrently.
+
+        :return: dict of rounded (latitude, longitude) to location
+        :rtype: dict
+        """
+        locations = {}
+        missing = []
+
+        for latitude, longitude in points:
+            point = _quantize_point(latitude, longitude, self.bing_maps.point_precision)
+            if point in locations:
+                continue
+
+            locations[point] = self.bing_maps._get_known_location(point)
+            if locations[point] is None:
+                missing.append(point)
+
+        resolved = await asyncio.gather(*[self._lookup_point(point) for point in missing])
+        locations.update(zip(missing, resolved))
+        return locations
+
+    async def get_transit_routes(self, source, destination, time=None, max_routes=None, objective="time"):
+        """
+        :param max_routes: number of routes to return, the best ones for `objective`, see
+                           BingMaps.get_transit_routes
+        :rtype: list of BingTransitRoute
+        """
+        time = time or BingDateTime.now()
+
+        response_dict = await self._get_json(*self.bing_maps._transit_request(source, destination, time))
+        routes = _select_transit_routes(response_dict["resourceSets"][0]["resources"], max_routes, objective)
+
+        locations = await self.get_locations_from_points(_get_transit_route_points(routes))
+        return self.bing_maps._build_transit_routes(routes, locations, time)
+
+    async def get_driving_route(self, source_location, dest_location, departure_date_time=None):
+        """
+        :rtype: BingDrivingRoute
+        """
+        self.bing_maps._check_driving_route_args(source_location, dest_location, departure_date_time)
+        cache_key = self.bing_maps._driving_route_cache_key(source_location, dest_location, departure_date_time)
+
+        cached = self.bing_maps.driving_route_cache.get(cache_key)
+        if cached is None:
+            persistent_cache = self.bing_maps.persistent_cache
+            fetched_routes = []
+
+            async def fetch():
+                if persistent_cache is not None:
+                    value = await self._run_blocking(persistent_cache.get, "driving", cache_key)
+                    if value is not None:
+                        self.bing_maps.driving_route_cache.set(cache_key, _driving_leg_from_persisted(value))
+                        return _driving_leg_from_persisted(value)
+
+                request = self.bing_maps._driving_request(source_location, dest_location, departure_date_time)
+                route = self.bing_maps._parse_driving_route(await self._get_json(*request), source_location,
+                                                            dest_location, departure_date_time)
+                self.bing_maps.driving_route_cache.set(cache_key, (route.distance, route.duration))
+                if persistent_cache is not None:
+                    self._persist("driving", cache_key, _driving_leg_to_persisted(route.distance, route.duration))
+                fetched_routes.append(route)
+                return route.distance, route.duration
+
+            # callers that shared the call of another one get a route for their own locations, as from the cache
+            cached = await self.singleflight.do("driving", cache_key, fetch)
+            if fetched_routes:
+                return fetched_routes[0]
+
+        distance, duration = cached
+        return BingDrivingRoute(source_location, dest_location, distance=distance, travel_duration=duration)
+
+    async def get_driving_distance_matrix(self, source_locations, dest_location, start_time=None):
+        """
+        :param start_time: departure time whose predicted traffic the durations use, see
+                           BingMaps.get_driving_distance_matrix
+        :return: (distance, duration) for each source, in order, or None if Bing found no route for it
+        :rtype: list of (BingDistance, BingDuration)
+        """
+        origins, origin_indices = self.bing_maps._get_matrix_origins(source_locations, dest_location)
+
+        chunks = [origins[chunk_start:chunk_start + DEFAULT_MATRIX_MAX_ORIGINS]
+                  for chunk_start in range(0, len(origins), DEFAULT_MATRIX_MAX_ORIGINS)]
+        requests = [self.bing_maps._distance_matrix_request(chunk, dest_location, start_time) for chunk in chunks]
+        responses = await asyncio.gather(*[self._get_json(*request) for request in requests])
+
+        results = []
+        for chunk, response_dict in zip(chunks, responses):
+            results.extend(self.bing_maps._parse_distance_matrix(response_dict, len(chunk), dest_location))
+
+        return [results[index] for index in origin_indices]
@@ -0,0 +1,115 @@
+import asyncio
+
+from common.bing_maps import (BingLocation, BingDateTime, BingApiError, BingRateLimitError, BingComplexRoute,
+                              RideShareRoute)
+from common import metrics
+from common import rate_limit
+from common import ranking
+from common.optimizer import RouteOptimizer, _skip_hybrid_candidates, _get_earliest_departure
+from common.util import is_correct_type_or_err
+
+
+class AsyncRouteOptimizer(object):
+    """
+        asyncio version of RouteOptimizer. Use `await AsyncRouteOptimizer.create(...)`, which fetches the
+        rideshare and transit routes concurrently.
+    """
+
+    def __init__(self, source, dest, optimization_type, depart_time, async_bing_maps, max_transit_routes=None):
+        is_correct_type_or_err(source, BingLocation)
+        is_correct_type_or_err(dest, BingLocation)
+        is_correct_type_or_err(depart_time, BingDateTime)
+
+        self.optimization_type = ranking.normalize_objective(optimization_type)
+
+        self.origin_source = source
+        self.final_dest = dest
+
+        self.async_bing_maps = async_bing_maps
+        self.depart_time = depart_time
+        self.max_transit_routes = max_transit_routes
+
+        self.uber_route = None
+        self.lyft_route = None
+        self.basic_transit_routes = []
+
+    @classmethod
+    async def create(cls, source, dest, optimization_type, depart_time, async_bing_maps, max_transit_routes=None):
+        """
+        :type async_bing_maps: AsyncBingMaps
+        :param max_transit_routes: see RouteOptimizer
+        :rtype: AsyncRouteOptimizer
+        """
+        optimizer = cls(source, dest, optimization_type, depart_time, async_bing_maps, max_transit_routes)
+        await optimizer._init_routes()
+        return optimizer
+
+    async def _init_routes(self):
+        ride_share_routes, transit_routes = await asyncio.gather(
+            self._get_ride_share_routes(self.origin_source, self.depart_time),
+            self.async_bing_maps.get_transit_routes(self.origin_source.address_str, self.final_dest.address_str,
+                                                    max_routes=self.max_transit_routes,
+                                                    objective=self.optimization_type))
+
+        self.uber_route = ride_share_routes["uber"]
+        self.lyft_route = ride_share_routes["lyft"]
+        self.basic_transit_routes = transit_routes
+
+    async def _get_ride_share_routes(self, source, depart_time):
+        depart_time = depart_time or BingDateTime.now()
+        driving_route = await self.async_bing_maps.get_driving_route(source, self.final_dest, depart_time)
+        return RideShareRoute.from_distance_duration(source, self.final_dest, driving_route.distance,
+                                                     driving_route.duration, depart_time)
+
+    async def get_simple_hybrid(self, transit_route):
+        return (await self.get_simple_hybrids([transit_route]))[0]
+
+    async def get_simple_hybrids(self, transit_routes):
+        """
+        Same as RouteOptimizer.get_simple_hybrids, with the fallback driving routes fetched as concurrent tasks.
+
+        :rtype: list of list of BingComplexRoute
+        """
+        candidates = [(index, candidate) for index, transit_route in enumerate(transit_routes)
+                      for candidate in RouteOptimizer._get_hybrid_candidates(transit_route)]
+
+        if candidates and metrics.is_over_budget():
+            _skip_hybrid_candidates(len(candidates))
+            candidates = []
+
+        try:
+            with rate_limit.call_priority(rate_limit.PRIORITY_HYBRID):
+                legs = await self.async_bing_maps.get_driving_distance_matrix(
+                    [candidate[1] for _, candidate in candidates], self.final_dest,
+                    _get_earliest_departure(candidates))
+        except BingRateLimitError:
+            # fetching the legs one by one would only wait longer for the limiter
+            _skip_hybrid_candidates(len(candidates))
+            candidates, legs = [], []
+        except BingApiError:
+            legs = [None] * len(candidates)
+
+        async def _evaluate(indexed_candidate, leg):
+            transit_route, rs_source, rs_depart_time = indexed_candidate[1]
+            if leg is None:
+                if metrics.is_over_budget():
+                    _skip_hybrid_candidates()
+                    return None
+                try:
+                    with rate_limit.call_priority(rate_limit.PRIORITY_HYBRID):
+                        ride_share_route = await self._get_ride_share_routes(rs_source, rs_depart_time)
+                except BingRateLimitError:
+                    _skip_hybrid_candidates()
+                    return None
+            else:
+                ride_share_route = RideShareRoute.from_distance_duration(rs_source, self.final_dest, leg[0], leg[1],
+                                                                         rs_depart_time)
+            return BingComplexRoute([transit_route, ride_share_route["uber"]])
+
+        complex_routes = await asyncio.gather(*[_evaluate(candidate, leg) for candidate, leg in zip(candidates, legs)])
+
+        results = [[] for _ in transit_routes]
+        for (index, _), complex_route in zip(candidates, complex_routes):
+            if complex_route is not None:
+                results[index].append(complex_route)
+        return results
@@ -0,0 +1,197 @@
+import re
+import time
+import threading
+
+DEFAULT_AUTOCOMPLETE_CACHE_SIZE = 20000
+DEFAULT_AUTOCOMPLETE_CACHE_TTL = 60 * 60  # seconds
+DEFAULT_MIN_REFINED_RESULTS = 3
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize_query(query):
+    """
+    :return: lower case words of the query separated by single spaces, e.g. "University  of WA," -> "university of wa"
+    """
+    return " ".join(_WORD.findall(query.lower()))
+
+
+def _matches_all_words(address_words, query_words):
+    # each word of the query must start a word of the address, the last one is usually being typed.
+    return all(any(address_word.startswith(word) for address_word in address_words) for word in query_words)
+
+
+class _TrieNode(object):
+    __slots__ = ("children", "entry")
+
+    def __init__(self):
+        self.children = {}
+        self.entry = None
+
+
+class _Entry(object):
+    __slots__ = ("query", "results", "address_words", "expires_at", "hits", "last_used")
+
+    def __init__(self, query, results, expires_at, now):
+        self.query = query
+        self.results = results
+        self.address_words = [_WORD.findall(location.address_str.lower()) for location, _ in results]
+        self.expires_at = expires_at
+        self.hits = 0
+        self.last_used = now
+
+
+class AutocompleteCache(object):
+    """
+        Prefix aware cache of place autocomplete results.
+
+        Results are stored in a trie keyed by the normalized query. A query that is not cached can still be
+        answered locally from the results of its longest cached prefix, when at least `min_refined_results`
+        of them still match every word typed so far. Every entry counts its hits, and the least popular
+        entries are evicted first so that the hot prefixes stay resident. Hit counts are halved at every
+        eviction, so that a prefix that is no longer used loses its place, and entries with as many hits are
+        evicted least recently used first, so that a new entry is not the first to go.
+    """
+
+    def __init__(self, max_size=DEFAULT_AUTOCOMPLETE_CACHE_SIZE, ttl=DEFAULT_AUTOCOMPLETE_CACHE_TTL,
+                 min_refined_results=DEFAULT_MIN_REFINED_RESULTS):
+        """
+        :param max_size: maximum number of cached queries
+        :param ttl: seconds after which a cached query is fetched again
+        :param min_refined_results: minimum number of results a refined prefix must keep to be served
+        """
+        if max_size <= 0:
+            raise ValueError("max_size must be a positive integer.")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.min_refined_results = min_refined_results
+
+        self.hits = 0
+        self.refined_hits = 0
+        self.misses = 0
+
+        self._root = _TrieNode()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, query):
+        """
+        :return: the cached, or locally refined, list of (BingLocation, confidence) for the query or None
+        """
+        key = normalize_query(query)
+        now = time.monotonic()
+
+        with self._lock:
+            node = self._root
+            prefix_entry = None
+
+            for char in key:
+                node = node.children.get(char)
+                if node is None:
+                    break
+                if node.entry is not None and node.entry.expires_at > now:
+                    prefix_entry = node.entry
+
+            if prefix_entry is not None and prefix_entry.query == key:
+                prefix_entry.hits += 1
+                prefix_entry.last_used = now
+                self.hits += 1
+                return prefix_entry.results
+
+            if prefix_entry is not None:
+                query_words = key.split(" ")
+                refined = [result for result, address_words in zip(prefix_entry.results, prefix_entry.address_words)
+                           if _matches_all_words(address_words, query_words)]
+
+                if refined and len(refined) >= min(self.min_refined_results, len(prefix_entry.results)):
+                    # the prefix served this query, so it counts towards keeping the prefix resident.
+                    prefix_entry.hits += 1
+                    prefix_entry.last_used = now
+                    self.refined_hits += 1
+                    return refined
+
+            self.misses += 1
+            return None
+
+    def set(self, query, results):
+        key = normalize_query(query)
+        if not key:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            node = self._root
+            for char in key:
+                node = node.children.setdefault(char, _TrieNode())
+
+            if node.entry is None:
+                self._size += 1
+            node.entry = _Entry(key, results, now + self.ttl, now)
+
+            if self._size > self.max_size:
+                self._evict(node.entry)
+
+    def _evict(self, new_entry):
+        # drop expired entries, then the least popular quarter so that evictions are amortized. The entry
+        # that was just set is kept.
+        now = time.monotonic()
+        entries = []
+        self._collect(self._root, "", entries)
+        entries = [(key, entry) for key, entry in entries if entry is not new_entry]
+
+        entries.sort(key=lambda item: (item[1].expires_at > now, item[1].hits, item[1].last_used))
+        num_expired = sum(1 for _, entry in entries if entry.expires_at <= now)
+        num_evicted = max(num_expired, len(entries) + 1 - self.max_size + self.max_size // 4)
+        for key, _ in entries[:num_evicted]:
+            self._remove(key)
+
+        # age the hits, so that the entries popular long ago do not outlive the ones popular now
+        for _, entry in entries[num_evicted:]:
+            entry.hits //= 2
+
+    def _collect(self, node, prefix, entries):
+        if node.entry is not None:
+            entries.append((prefix, node.entry))
+        for char, child in node.children.items():
+            self._collect(child, prefix + char, entries)
+
+    def _remove(self, key):
+        path = [self._root]
+        for char in key:
+            path.append(path[-1].children[char])
+
+        path[-1].entry = None
+        self._size -= 1
+
+        # prune the branch that no longer leads to any entry
+        for char, parent, node in zip(reversed(key), reversed(path[:-1]), reversed(path[1:])):
+            if node.entry is not None or node.children:
+                break
+            del parent.children[char]
+
+    def clear(self):
+        with self._lock:
+            self._root = _TrieNode()
+            self._size = 0
+            self.hits = 0
+            self.refined_hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        """
+        :return: dict of size, hits, refined hits, misses and hit ratio of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.refined_hits + self.misses
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "refined_hits": self.refined_hits,
+                "misses": self.misses,
+                "hit_ratio": float(self.hits + self.refined_hits) / lookups if lookups else 0.0
+            }
@@ -5,67 +5,201 @@
 
 import os
 import sys
+import time
 import functools
 import datetime
+import threading
+from collections.abc import Sequence
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from yaml import safe_load
 from common.util import dict_to_pretty_str, is_correct_type_or_err
+from common import metrics
+from common import rate_limit
+from common import ranking
+from common.cache import TTLCache
+from common.singleflight import SingleFlight
+from common.persistent_cache import PersistentCache
+from common.autocomplete import AutocompleteCache, normalize_query
+from common.spatial_index import SpatialIndex
+from common.replay import RecordingTransport, ReplayTransport
+from common.transport import BingTransport
 from common.rideshare_estimates import LyftEstimate, UberEstimate
 
+BING_API_URL = "http://dev.virtualearth.net/REST/v1"
 BING_API_CREDENTIALS = os.path.abspath(os.path.join(os.path.dirname(__file__), "bing.key.yaml"))
 
+# 5 decimal places is roughly 1.1 metres at the equator, well within the accuracy of a bus stop.
+DEFAULT_POINT_PRECISION = 5
+DEFAULT_REVERSE_GEOCODE_CACHE_SIZE = 50000
+DEFAULT_REVERSE_GEOCODE_CACHE_TTL = 24 * 60 * 60  # seconds
+DEFAULT_GEOCODE_WORKERS = 8
+DEFAULT_DRIVING_ROUTE_CACHE_SIZE = 20000
+DEFAULT_DRIVING_ROUTE_CACHE_TTL = 60 * 60  # seconds
+DEFAULT_DRIVING_TIME_BUCKET = 15 * 60  # seconds, routes are optimized for traffic at the departure time
+DEFAULT_MATRIX_MAX_ORIGINS = 100
+DEFAULT_SPATIAL_INDEX_RADIUS = 10  # meters
+DEFAULT_WARM_START_ENTRIES = 20000  # per namespace of the persistent cache
+
 def _get_api_key_from_file(filename=BING_API_CREDENTIALS):
     with open(filename, 'r') as config_file:
         config = safe_load(config_file)
     return config["queryKey"]
 
 
+class ApiKeyFile(object):
+    """
+        Bing Maps key read from a yaml file. The file is only parsed again when its modification
+        time changes, so the key can be rotated without restarting the server.
+    """
+
+    def __init__(self, filename=BING_API_CREDENTIALS):
+        self.filename = filename
+        self._key = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def key(self):
+        mtime = os.stat(self.filename).st_mtime
+        if mtime == self._mtime:
+            return self._key
+
+        with self._lock:
+            if mtime != self._mtime:
+                self._key = _get_api_key_from_file(self.filename)
+                self._mtime = mtime
+            return self._key
+
+
 class BingApiError(Exception):
     pass
 
 
+class BingRateLimitError(BingApiError):
+    """
+        The call was not sent because the client side rate limit was reached.
+    """
+    pass
+
+
 class BingType(object):
+    """
+        Base of the Bing model types. They declare their attributes in __slots__: a request creates thousands
+        of instances, which then take no per instance __dict__.
+    """
+    __slots__ = ()
+
+    def _attributes(self):
+        attributes = {}
+        for cls in reversed(type(self).__mro__):
+            for name in cls.__dict__.get("__slots__", ()):
+                if hasattr(self, name):
+                    attributes[name] = getattr(self, name)
+        attributes.update(getattr(self, "__dict__", {}))
+        return attributes
+
     def __str__(self):
         try:
-            return dict_to_pretty_str(str(self.__dict__))
+            return dict_to_pretty_str(str(self._attributes()))
         except Exception as e:
-            return str(self.__dict__)
+            return str(self._attributes())
 
 class BingDateTime(BingType):
+    """
+        Point in time, stored as milliseconds since the epoch and the UTC offset Bing reported with it.
 
-    def __init__(self, date_time):
-        self.date_time = date_time
-        date = self.date_time.strftime("%m/%d/%y")
-        time = self.date_time.strftime("%H:%M:%S")
-        self.date_time_str = date + " " + time
+        The datetime and the string are only built when they are used, most timestamps of a transit response
+        are never formatted.
+    """
+    __slots__ = ("_epoch_ms", "_date_time", "_date_time_str", "utc_offset")
+
+    def __init__(self, date_time=None, epoch_ms=None, utc_offset=None):
+        """
+        :param date_time: naive local datetime, or
+        :param epoch_ms: milliseconds since the epoch
+        :param utc_offset: minutes east of UTC of the place the time is reported for, e.g. -420 for "-0700"
+        """
+        if (date_time is None) == (epoch_ms is None):
+            raise ValueError("Exactly one of date_time and epoch_ms must be supplied.")
+
+        self._date_time = date_time
+        self._epoch_ms = epoch_ms
+        self._date_time_str = None
+        self.utc_offset = utc_offset
+
+    @property
+    def epoch_ms(self):
+        if self._epoch_ms is None:
+            self._epoch_ms = int(round(self._date_time.timestamp() * 1000))
+        return self._epoch_ms
+
+    @property
+    def date_time(self):
+        if self._date_time is None:
+            self._date_time = datetime.datetime.fromtimestamp(self._epoch_ms / 1000.0)
+        return self._date_time
+
+    @property
+    def date_time_str(self):
+        """
+        :return: local time as "%m/%d/%y %H:%M:%S", e.g. "07/23/19 16:30:00"
+        """
+        if self._date_time_str is None:
+            if self._date_time is not None:
+                local = self._date_time.timetuple()
+            else:
+                local = time.localtime(self._epoch_ms // 1000)
+            self._date_time_str = "%02d/%02d/%02d %02d:%02d:%02d" % (local.tm_mon, local.tm_mday, local.tm_year % 100,
+                                                                     local.tm_hour, local.tm_min, local.tm_sec)
+        return self._date_time_str
+
+    def __add__(self, duration):
+        """
+        :type duration: datetime.timedelta
+        :rtype: BingDateTime
+        """
+        return BingDateTime(epoch_ms=self.epoch_ms + int(round(duration.total_seconds() * 1000)),
+                            utc_offset=self.utc_offset)
 
     def __str__(self):
         return self.date_time_str
 
     @staticmethod
     def now():
-        time_now = datetime.datetime.now()
-        return BingDateTime(time_now)
+        return BingDateTime(epoch_ms=int(time.time() * 1000))
 
     @staticmethod
-    def from_bing_api_time(time):
-        time = time.lstrip("/Date(").rstrip(")/")
-
-        if "-" in time:
-            seconds_from_epoch, offset = time.split("-")
-        elif "+" in time:
-            seconds_from_epoch, offset = time.split("+")
-        else:
-            seconds_from_epoch = time[:-4]
-            offset = time[-4:]
+    def from_date_time_str(date_time_str):
+        """
+        :param date_time_str: a date_time_str, e.g. "07/23/19 16:30:00"
+        """
+        date_time = BingDateTime(datetime.datetime.strptime(date_time_str, "%m/%d/%y %H:%M:%S"))
+        date_time._date_time_str = date_time_str
+        return date_time
 
-        seconds_from_epoch = float(seconds_from_epoch) / 1000
-        offset = float(offset)
+    @staticmethod
+    def from_bing_api_time(api_time):
+        """
+        :param api_time: time in the format of the Bing REST services, e.g. "/Date(1563915000000-0700)/"
+        """
+        # "/Date(" is 6 characters, ")/" is 2 and the offset, when there is one, is a sign and 4 digits
+        if not (api_time.startswith("/Date(") and api_time.endswith(")/")):
+            raise BingApiError("Invalid Bing Maps time '{}'.".format(api_time))
 
-        return BingDateTime(datetime.datetime.fromtimestamp(seconds_from_epoch))
+        try:
+            sign = api_time[-7]
+            if (sign == "-" or sign == "+") and len(api_time) > 13:
+                utc_offset = int(api_time[-6:-4]) * 60 + int(api_time[-4:-2])
+                return BingDateTime(epoch_ms=int(api_time[6:-7]), utc_offset=-utc_offset if sign == "-" else utc_offset)
+            return BingDateTime(epoch_ms=int(api_time[6:-2]))
+        except ValueError:
+            raise BingApiError("Invalid Bing Maps time '{}'.".format(api_time))
 
 
 class BingDistance(BingType):
+    __slots__ = ("value", "unit")
+
     def __init__(self, value, unit):
         self.value = value
         self.unit = unit.lower()
@@ -75,6 +209,7 @@ class BingDistance(BingType):
 
 
 class BingDuration(datetime.timedelta, BingType):
+    __slots__ = ()
 
     @staticmethod
     def from_value_and_unit(value, unit):
@@ -90,10 +225,13 @@ class BingDuration(datetime.timedelta, BingType):
             raise BingApiError("Error identifying unit: {}".format(unit))
 
 class BingLocation(BingType):
+    __slots__ = ("point_list", "point_as_str", "address_str")
+
     def __init__(self, point, address):
         self.point_list = point  # list of latitude and longiturde
         self.point_as_str = ",".join([str(coord) for coord in self.point_list])
-        self.address_str = address
+        # the same addresses come back in many responses, keep a single copy of each
+        self.address_str = sys.intern(address)
 
     @staticmethod
     def from_location_resource(resource):
@@ -150,6 +288,8 @@ class BingLocation(BingType):
         }
 
 class BingDepartArrive(BingType):
+    __slots__ = ("manType", "time", "names", "coords", "type")
+
     def __init__(self, type, time, mt=None, names=None, coords=None):
         self.manType = mt
         self.time = time
@@ -162,15 +302,22 @@ class BingDepartArrive(BingType):
 
 
 class BingWalkSegment(BingType):
-    def __init__(self, start_location = None, mantype= None, dist= None, duration=None, cost= None):
+    __slots__ = ("start_location", "manType", "dist", "duration", "cost", "text", "agency")
+
+    def __init__(self, start_location = None, mantype= None, dist= None, duration=None, cost= None, text=None, agency="walk"):
         self.start_location = start_location
         self.manType = mantype
         self.dist = dist
         self.duration = duration
         self.cost = cost
+        self.text = text
+        self.agency = agency
 
 
 class BingTransportSegment(BingType):
+    __slots__ = ("typeofTransport", "depart_details", "arrive_details", "dist", "duration", "manType", "text", "cost",
+                 "agency")
+
     def __init__(self, typeoftransport=None, depart_details=None, arrive_details=None, mantype=None, text=None, dist=None, duration=None, cost=None, agency=None):
         self.typeofTransport = typeoftransport
         self.depart_details = depart_details
@@ -183,7 +330,109 @@ class BingTransportSegment(BingType):
         self.agency = agency
 
 
+class SegmentsView(Sequence):
+    """
+        Read only view of the first `end` segments of a transit route. Truncated transit routes share
+        the segments of the route they were created from instead of copying them, and the segments are
+        only built when one of them is read.
+    """
+
+    def __init__(self, route_segments, end):
+        self._route_segments = route_segments
+        self._end = end
+
+    def __len__(self):
+        return self._end
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._route_segments.segments[:self._end][index]
+
+        if index < 0:
+            index += self._end
+        if not 0 <= index < self._end:
+            raise IndexError("segment index out of range")
+        return self._route_segments.segments[index]
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class _TransitRouteSegments(object):
+    """
+        Segments of a transit route with the prefix sums needed to describe any of its truncated routes in O(1).
+
+        The prefix sums only need the duration, agency and cost of every segment, which are cheap to read from
+        the route resource. The segments and the start and end locations of the route need reverse geocoded
+        addresses, so they can be left to `load`, which is called the first time one of them is read.
+    """
+
+    def __init__(self, total_duration, summaries, segments=None, start_location=None, end_location=None,
+                 load=None):
+        """
+        :param summaries: (duration, agency, cost) of every segment
+        :param load: function without arguments that returns (segments, start_location, end_location),
+                     required if `segments` is None
+        """
+        self.total_duration = total_duration
+        self.num_segments = len(summaries)
+
+        self._segments = segments
+        self._start_location = start_location
+        self._end_location = end_location
+        self._load = load
+        self._lock = threading.Lock()
+
+        # cumulative_durations[i] and fares[i] are the duration and fare of the first i segments
+        self.cumulative_durations = [datetime.timedelta(0)]
+        self.fares = [0]
+
+        agencies = set()
+        for duration, agency, cost in summaries:
+            self.cumulative_durations.append(self.cumulative_durations[-1] + duration)
+
+            if agency in agencies:
+                # don't add cost for transfers
+                self.fares.append(self.fares[-1])
+            else:
+                agencies.add(agency)
+                self.fares.append(self.fares[-1] + cost)
+
+    @staticmethod
+    def from_segments(segments, total_duration, start_location, end_location):
+        summaries = [(segment.duration, segment.agency, segment.cost) for segment in segments]
+        return _TransitRouteSegments(total_duration, summaries, segments, start_location, end_location)
+
+    @property
+    def is_loaded(self):
+        return self._segments is not None
+
+    def _ensure_loaded(self):
+        if self._segments is None:
+            with self._lock:
+                if self._segments is None:
+                    segments, self._start_location, self._end_location = self._load()
+                    self._segments = segments
+                    self._load = None
+
+    @property
+    def segments(self):
+        self._ensure_loaded()
+        return self._segments
+
+    @property
+    def start_location(self):
+        self._ensure_loaded()
+        return self._start_location
+
+    @property
+    def end_location(self):
+        self._ensure_loaded()
+        return self._end_location
+
+
 class BingTransitRoute(BingType):
+    __slots__ = ("_route_segments", "_end_location", "segments", "duration", "fare", "start_time", "end_time")
 
     def __init__(self, segments, total_duration, start_location, end_location, departure_date_time):
         is_correct_type_or_err(segments, list)
@@ -198,53 +447,80 @@ class BingTransitRoute(BingType):
             except TypeError:
                 is_correct_type_or_err(segment, BingTransportSegment)
 
-        self.segments = segments
-        self.duration = total_duration
-        self.fare = 0
-        self.start_location = start_location
-        self.end_location = end_location
-
-        agency_cost = {}
+        route_segments = _TransitRouteSegments.from_segments(segments, total_duration, start_location, end_location)
+        self._init_prefix(route_segments, len(segments), None, departure_date_time)
 
-        for segment in segments:
-            agency_name = segment.agency
+    @staticmethod
+    def from_route_segments(route_segments, departure_date_time):
+        """
+        :param route_segments: segments of the route, possibly not loaded yet
+        :type route_segments: _TransitRouteSegments
+        :rtype: BingTransitRoute
+        """
+        route = BingTransitRoute.__new__(BingTransitRoute)
+        route._init_prefix(route_segments, route_segments.num_segments, None, departure_date_time)
+        return route
 
-            if agency_name in agency_cost:
-                # don't add cost for transfers
-                pass
-            else:
-                agency_cost[agency_name] = segment.cost
+    def _init_prefix(self, route_segments, end, end_location, departure_date_time):
+        """
+        :param end_location: end of the truncated route, None if the route ends where the full route does
+        """
+        self._route_segments = route_segments
+        self._end_location = end_location
+        self.segments = SegmentsView(route_segments, end)
 
-        for _, price in agency_cost.items():
-            self.fare = self.fare + price
+        removed_duration = route_segments.cumulative_durations[-1] - route_segments.cumulative_durations[end]
+        if removed_duration:
+            self.duration = BingDuration(seconds=(route_segments.total_duration - removed_duration).total_seconds())
+        else:
+            self.duration = route_segments.total_duration
+        self.fare = route_segments.fares[end]
 
         self.start_time = departure_date_time
-        self.end_time = BingDateTime(self.start_time.date_time + total_duration)
+        self.end_time = self.start_time + self.duration
+
+    @property
+    def start_location(self):
+        return self._route_segments.start_location
+
+    @property
+    def end_location(self):
+        if self._end_location is None:
+            return self._route_segments.end_location
+        return self._end_location
+
+    @property
+    def is_loaded(self):
+        """
+        :return: whether the segments and the locations of the route have been built
+        """
+        return self._route_segments.is_loaded
 
     def get_route_without_last_segment(self):
         """
-        Return a new route without the
-        :return:
+        Return a new route without the last segment. The new route shares the segments of this route,
+        so it is created in constant time and space.
+
+        :return: route ending where the last segment of this route starts
+        :rtype: BingTransitRoute
         """
         if len(self.segments) <= 1:
             raise ValueError("Route must have more than one segment to return a route without the last segment")
 
-        from copy import deepcopy
-        segments = deepcopy(self.segments)
-        last_segment = segments.pop()
-        duration = BingDuration(seconds=(self.duration - last_segment.duration).total_seconds())
-
+        last_segment = self.segments[-1]
 
         try:
             new_end_location = last_segment.depart_details.coords
         except AttributeError:
             new_end_location = last_segment.start_location
 
-        return BingTransitRoute(segments, duration, self.start_location, new_end_location, self.start_time)
-
+        route = BingTransitRoute.__new__(BingTransitRoute)
+        route._init_prefix(self._route_segments, len(self.segments) - 1, new_end_location, self.start_time)
+        return route
 
 
 class BingDrivingRoute(BingType):
+    __slots__ = ("source", "dest", "distance", "duration", "time_requested")
 
     def __init__(self, source, dest, distance, travel_duration, departure_date_time=None):
         is_correct_type_or_err(source, BingLocation)
@@ -268,6 +544,7 @@ class BingDrivingRoute(BingType):
         return BingDrivingRoute(source_location, dest_location, distance=distance, travel_duration=duration, departure_date_time=None)
 
 class RideShareRoute(BingDrivingRoute):
+    __slots__ = ("fare", "type")
 
     def __init__(self, *args, **kwargs):
         self.fare = kwargs.pop("fare")
@@ -285,14 +562,16 @@ class RideShareRoute(BingDrivingRoute):
         return RideShareRoute(source=driving_route.source, dest=driving_route.dest, distance=driving_route.distance, )
 
     @staticmethod
-    def from_source_dest(source, dest, depart_time=None):
-        bing_maps = BingMaps()
+    def from_source_dest(source, dest, depart_time=None, bing_maps=None):
+        bing_maps = bing_maps or get_default_bing_maps()
         depart_time = depart_time or BingDateTime.now()
 
         driving_route = bing_maps.get_driving_route(source, dest, depart_time)
-        distance = driving_route.distance
-        duration = driving_route.duration
+        return RideShareRoute.from_distance_duration(source, dest, driving_route.distance,
+                                                     driving_route.duration, depart_time)
 
+    @staticmethod
+    def from_distance_duration(source, dest, distance, duration, depart_time):
         lyft_fare = LyftEstimate.estimate_fare(distance.value, duration.total_seconds())
         uber_fare = UberEstimate.estimate_fare(distance.value, duration.total_seconds())
 
@@ -308,6 +587,8 @@ class BingComplexRoute(BingType):
     """
         Class that defines a route that is a combination of Transit and RideShare
     """
+    __slots__ = ("routes", "total_fare", "total_duration", "start_time", "end_time")
+
     def __init__(self, routes):
         self.routes = routes
         self.total_fare = functools.reduce(lambda sum, route: sum + route.fare, routes, 0)
@@ -315,20 +596,314 @@ class BingComplexRoute(BingType):
         self.total_duration = BingDuration(seconds=agg_duration_secs)
 
         self.start_time =  self.routes[0].start_time if hasattr(self.routes[0], 'start_time') else self.routes[0].time_requested
-        self.end_time = BingDateTime(self.start_time.date_time + self.total_duration)
+        self.end_time = self.start_time + self.total_duration
+
+
+def _is_walk_itinerary_item(itinerary_item):
+    try:
+        return itinerary_item["iconType"].lower() == "walk"
+    except IndexError:
+        return 'childItineraryItems' not in itinerary_item
+
+
+def _get_transit_route_points(routes):
+    """
+    :param routes: route resources of a Routes/Transit response
+    :return: coordinates of every point whose address is needed to build the transit routes
+    """
+    points = []
+    for route in routes:
+        route_leg = route["routeLegs"][0]
+        points.append(route_leg["actualStart"]["coordinates"])
+        points.append(route_leg["actualEnd"]["coordinates"])
+
+        for item in route_leg["itineraryItems"]:
+            if _is_walk_itinerary_item(item):
+                points.append(item["maneuverPoint"]["coordinates"])
+            else:
+                points.append(item["childItineraryItems"][0]["maneuverPoint"]["coordinates"])
+                points.append(item["childItineraryItems"][-1]["maneuverPoint"]["coordinates"])
+    return points
+
+
+def _get_itinerary_item_agency_and_cost(itinerary_item):
+    if _is_walk_itinerary_item(itinerary_item):
+        return "walk", 0
+    cost = 2.75 if itinerary_item["travelDistance"] > 10 else 3.75
+    return sys.intern(itinerary_item["transitLine"]["agencyName"]), cost
+
+
+def _get_transit_route_summaries(route):
+    """
+    :param route: route resource of a Routes/Transit response
+    :return: (duration, agency, cost) of every segment of the route, read without building the segments
+    """
+    summaries = []
+    for item in route["routeLegs"][0]["itineraryItems"]:
+        agency, cost = _get_itinerary_item_agency_and_cost(item)
+        summaries.append((BingDuration.from_value_and_unit(item["travelDuration"], route["durationUnit"]),
+                          agency, cost))
+    return summaries
+
+
+def _select_transit_routes(routes, max_routes=None, objective="time"):
+    """
+    :param routes: route resources of a Routes/Transit response
+    :param max_routes: number of routes to keep, all of them if None
+    :param objective: one of ranking.OBJECTIVES the routes are selected by
+    :return: the `max_routes` best routes for the objective, in the order of the response
+    """
+    if max_routes is None or len(routes) <= max_routes:
+        return routes
+
+    records = []
+    for index, route in enumerate(routes):
+        total_duration = BingDuration.from_value_and_unit(route["travelDuration"], route["durationUnit"])
+        fare = _TransitRouteSegments(total_duration, _get_transit_route_summaries(route)).fares[-1]
+        records.append((total_duration.total_seconds(), fare, index))
+
+    # sorted is stable, so equally good routes are kept in the order of the response
+    best = sorted(records, key=ranking.get_objective_key(objective))[:max_routes]
+    return [routes[index] for index in sorted(record[2] for record in best)]
+
+
+def _call_once(function):
+    """
+    :return: function that calls `function` the first time it succeeds and returns the same result afterwards
+    """
+    lock = threading.Lock()
+    result = []
+
+    def call():
+        with lock:
+            if not result:
+                result.append(function())
+        return result[0]
+
+    return call
+
+
+def _location_to_persisted(location):
+    return [location.point_list, location.address_str]
+
+
+def _location_from_persisted(value):
+    return BingLocation(point=value[0], address=value[1])
+
+
+def _driving_leg_to_persisted(distance, duration):
+    return [distance.value, distance.unit, duration.total_seconds()]
+
+
+def _driving_leg_from_persisted(value):
+    return BingDistance(value[0], value[1]), BingDuration(seconds=value[2])
+
+
+def _quantize_point(latitude, longitude, precision=DEFAULT_POINT_PRECISION):
+    try:
+        return round(float(latitude), precision), round(float(longitude), precision)
+    except (TypeError, ValueError):
+        raise BingApiError("Invalid lat '{}' and long '{}'.".format(latitude, longitude))
 
 
 class BingMaps(object):
-    def __init__(self, api_key=None):
-        self.key = api_key or _get_api_key_from_file()
+
+    """
+        Client for the Bing Maps REST services. An instance owns its caches and connection pool and is
+        safe to share between threads, use get_default_bing_maps() to get the process wide client.
+    """
+
+    def __init__(self, api_key=None, reverse_geocode_cache=None, point_precision=DEFAULT_POINT_PRECISION,
+                 geocode_workers=DEFAULT_GEOCODE_WORKERS, transport=None, key_file=None,
+                 driving_route_cache=None, driving_time_bucket=DEFAULT_DRIVING_TIME_BUCKET, base_url=BING_API_URL,
+                 autocomplete_cache=None, spatial_index=None, spatial_index_radius=DEFAULT_SPATIAL_INDEX_RADIUS,
+                 record_dir=None, replay_dir=None, singleflight=None, rate_limiter=None, persistent_cache=None):
+        """
+        :param api_key: Bing Maps key, read from `key_file` if not supplied
+        :param reverse_geocode_cache: cache of quantized (lat, long) to BingLocation
+        :type reverse_geocode_cache: TTLCache
+        :param point_precision: number of decimal places points are rounded to before lookup
+        :type point_precision: int
+        :param geocode_workers: maximum number of concurrent reverse geocode lookups
+        :type geocode_workers: int
+        :param transport: pooled HTTP transport used for every Bing call
+        :type transport: BingTransport
+        :param key_file: file the key is read from, defaults to bing.key.yaml
+        :type key_file: ApiKeyFile
+        :param driving_route_cache: cache of (source point, dest point, departure bucket) to (distance, duration)
+        :type driving_route_cache: TTLCache
+        :param driving_time_bucket: width in seconds of the departure time buckets of the driving route cache
+        :type driving_time_bucket: int
+        :param base_url: root of the Bing Maps REST services, e.g. a local stub server
+        :type base_url: str
+        :param autocomplete_cache: prefix aware cache of get_possible_locations_from_string results
+        :type autocomplete_cache: AutocompleteCache
+        :param spatial_index: known addresses, a point within `spatial_index_radius` meters of one of them
+                              resolves to it without calling Bing. Resolved points are added to it, the default
+                              one keeps them as long as the reverse geocode cache
+        :type spatial_index: SpatialIndex
+        :param spatial_index_radius: search radius in meters, 0 disables the spatial index
+        :type spatial_index_radius: float
+        :param record_dir: if set, every Bing response is saved in this directory
+        :type record_dir: str
+        :param replay_dir: if set, Bing is never called and responses are replayed from this directory
+        :type replay_dir: str
+        :param singleflight: coalesces concurrent identical point lookups, geocode queries and driving routes
+        :type singleflight: SingleFlight
+        :param rate_limiter: limits the rate of every call of this client, calls are not limited if None
+        :type rate_limiter: RateLimiter
+        :param persistent_cache: on disk tier behind the reverse geocode, geocode query and driving route caches,
+                                 shared with the other processes of the host and kept across restarts
+        :type persistent_cache: PersistentCache
+        """
+        self._api_key = api_key
+        self._key_file = None if api_key else key_file or ApiKeyFile()
+        self.key  # fail early if the key file is missing
+
+        if reverse_geocode_cache is None:
+            reverse_geocode_cache = TTLCache(max_size=DEFAULT_REVERSE_GEOCODE_CACHE_SIZE,
+                                             ttl=DEFAULT_REVERSE_GEOCODE_CACHE_TTL)
+        self.reverse_geocode_cache = reverse_geocode_cache
+        self.point_precision = point_precision
+        self.geocode_workers = geocode_workers
+        self.transport = transport or BingTransport()
+        if replay_dir:
+            self.transport = ReplayTransport(replay_dir, timeouts=self.transport.timeouts)
+        elif record_dir:
+            self.transport = RecordingTransport(self.transport, record_dir)
+        if driving_route_cache is None:
+            driving_route_cache = TTLCache(max_size=DEFAULT_DRIVING_ROUTE_CACHE_SIZE,
+                                           ttl=DEFAULT_DRIVING_ROUTE_CACHE_TTL)
+        self.driving_route_cache = driving_route_cache
+        self.driving_time_bucket = driving_time_bucket
+        self.base_url = base_url.rstrip("/")
+        self.autocomplete_cache = AutocompleteCache() if autocomplete_cache is None else autocomplete_cache
+        if spatial_index is None:
+            # resolved points are indexed for as long, and as many of them, as the reverse geocode cache keeps
+            spatial_index = SpatialIndex(max_inserted=self.reverse_geocode_cache.max_size,
+                                         inserted_ttl=self.reverse_geocode_cache.ttl)
+        self.spatial_index = spatial_index
+        self.spatial_index_radius = spatial_index_radius
+        self.singleflight = singleflight or SingleFlight()
+        self.rate_limiter = rate_limiter
+        self.persistent_cache = persistent_cache
+
+    @property
+    def key(self):
+        return self._api_key or self._key_file.key
+
+    def cache_stats(self):
+        """
+        :return: hit/miss counters of the caches used by this client, keyed by cache name
+        :rtype: dict
+        """
+        stats = {
+            "reverse_geocode": self.reverse_geocode_cache.stats(),
+            "driving_route": self.driving_route_cache.stats(),
+            "autocomplete": self.autocomplete_cache.stats(),
+            "spatial_index": self.spatial_index.stats()
+        }
+        if self.persistent_cache is not None:
+            stats["persistent"] = self.persistent_cache.stats()
+        return stats
+
+    def coalescing_stats(self):
+        """
+        :return: number of Bing calls made and saved by sharing identical calls in flight, see SingleFlight.stats
+        :rtype: dict
+        """
+        return self.singleflight.stats()
+
+    def clear_caches(self):
+        self.reverse_geocode_cache.clear()
+        self.driving_route_cache.clear()
+        self.autocomplete_cache.clear()
+        self.spatial_index.clear()
+        self.singleflight.clear()
+
+    def warm_start(self, max_entries=DEFAULT_WARM_START_ENTRIES):
+        """
+        Load the most used entries of the persistent cache into the in memory caches, e.g. when a server starts.
+
+        :param max_entries: maximum number of entries loaded per kind of lookup
+        :return: number of entries loaded
+        :rtype: int
+        """
+        if self.persistent_cache is None:
+            return 0
+
+        loaded = 0
+        for point, value in self.persistent_cache.hottest("locations_point", max_entries):
+            self._remember_location(tuple(point), _location_from_persisted(value))
+            loaded += 1
+
+        for query, resources in self.persistent_cache.hottest("locations_query", max_entries):
+            try:
+                self.autocomplete_cache.set(query, self._possible_locations_from_query_results(resources))
+            except BingApiError:
+                continue
+            loaded += 1
+
+        for key, value in self.persistent_cache.hottest("driving", max_entries):
+            source_point, dest_point, bucket = key
+            self.driving_route_cache.set((tuple(source_point), tuple(dest_point), bucket),
+                                         _driving_leg_from_persisted(value))
+            loaded += 1
+
+        return loaded
+
+    def _acquire_call(self, endpoint, priority=None):
+        """
+        Wait for the rate limiter to allow a call, with the priority of the endpoint unless `priority` is given.
+
+        :raises: BingRateLimitError if the call could not be allowed in time
+        """
+        if priority is None:
+            priority = rate_limit.get_call_priority(endpoint)
+        if not self.rate_limiter.acquire(priority):
+            raise BingRateLimitError("Too many Bing Maps API calls, the '{}' call was not sent.".format(endpoint))
+
+    def _get_json(self, endpoint, url, params):
+        if self.rate_limiter is not None:
+            self._acquire_call(endpoint)
+
+        with metrics.time_upstream_call(endpoint) as call:
+            try:
+                response = self.transport.get(endpoint, url, params)
+                call.failed = response.status_code >= 400
+                return response.json()
+            except requests.RequestException as e:
+                raise BingApiError("Error calling the Bing Maps API: {}".format(e))
+            except ValueError:
+                raise BingApiError("The Bing Maps API returned an invalid response for '{}'.".format(url))
 
     def _get_locations_for_query(self, location_str):
-        url = "http://dev.virtualearth.net/REST/v1/Locations"
+        # the returned location resources are shared by the concurrent callers, who must not modify them
+        return self.singleflight.do("locations_query", normalize_query(location_str),
+                                    functools.partial(self._fetch_locations_for_query, location_str))
+
+    def _fetch_locations_for_query(self, location_str):
+        if self.persistent_cache is not None:
+            locations = self.persistent_cache.get("locations_query", normalize_query(location_str))
+            if locations is not None:
+                return locations
+
+        response_dict = self._get_json(*self._locations_query_request(location_str))
+        locations = self._parse_locations_for_query(response_dict, location_str)
+        if self.persistent_cache is not None and locations:
+            self.persistent_cache.set("locations_query", normalize_query(location_str), locations)
+        return locations
+
+    def _locations_query_request(self, location_str):
+        url = self.base_url + "/Locations"
         params = {
             "query": location_str,
             "key": self.key
         }
-        response_dict = requests.get(url, params).json()
+        return "locations_query", url, params
+
+    @staticmethod
+    def _parse_locations_for_query(response_dict, location_str):
         try:
             locations = response_dict["resourceSets"][0]["resources"]
         except IndexError:
@@ -349,7 +924,10 @@ class BingMaps(object):
         :raises: BingApiError if no valid location was returned
         """
         locations = self._get_locations_for_query(location_str)
+        return self._location_from_query_results(locations, location_str)
 
+    @staticmethod
+    def _location_from_query_results(locations, location_str):
         if not locations:
             raise BingApiError("No locations match the query string {}".format(location_str))
 
@@ -358,7 +936,8 @@ class BingMaps(object):
     def get_location_from_point(self, latitude, longitude):
         """
         Get Location object from point. This is helpful for getting the address of a point.
-        Please do not ABUSE this method as it ALWAYS calls the Bing API.
+        Points are rounded to `point_precision` decimal places and looked up in the reverse geocode
+        cache, then in the spatial index of known addresses, before calling the Bing API.
 
         :param latitude: Latitude, first index in point array
         :type latitude: float
@@ -368,18 +947,97 @@ class BingMaps(object):
         :rtype: BingLocation
         :raises: BingApiError if no valid location was returned
         """
+        point = _quantize_point(latitude, longitude, self.point_precision)
+
+        location = self._get_known_location(point)
+        if location is None:
+            location = self._lookup_point(point)
+        return location
+
+    def _get_known_location(self, point):
+        """
+        :return: location of the rounded point from the cache or the spatial index, None if it must be looked up
+        """
+        location = self.reverse_geocode_cache.get(point)
+        if location is None and self.spatial_index_radius:
+            location = self.spatial_index.nearest(point[0], point[1], self.spatial_index_radius)
+            if location is not None:
+                self.reverse_geocode_cache.set(point, location)
+        return location
+
+    def _remember_location(self, point, location):
+        self.reverse_geocode_cache.set(point, location)
+        if self.spatial_index_radius:
+            self.spatial_index.insert(point[0], point[1], location)
+
+    def _lookup_point(self, point):
+        return self.singleflight.do("locations_point", point, functools.partial(self._fetch_point, point))
+
+    def _fetch_point(self, point):
+        location = None
+        if self.persistent_cache is not None:
+            value = self.persistent_cache.get("locations_point", point)
+            if value is not None:
+                location = _location_from_persisted(value)
+
+        if location is None:
+            location = self._get_location_from_point(*point)
+            if self.persistent_cache is not None:
+                self.persistent_cache.set("locations_point", point, _location_to_persisted(location))
+
+        self._remember_location(point, location)
+        return location
+
+    def get_locations_from_points(self, points):
+        """
+        Resolve many points at once. Points are deduplicated after rounding and the ones missing from
+        the reverse geocode cache are looked up concurrently, so the call takes about as long as the
+        slowest single lookup.
+
+        :param points: iterable of (latitude, longitude) pairs
+        :return: dict of rounded (latitude, longitude) to location
+        :rtype: dict
+        :raises: BingApiError if any of the points could not be resolved
+        """
+        locations = {}
+        missing = []
+
+        for latitude, longitude in points:
+            point = _quantize_point(latitude, longitude, self.point_precision)
+            if point in locations:
+                continue
+
+            locations[point] = self._get_known_location(point)
+            if locations[point] is None:
+                missing.append(point)
+
+        if len(missing) == 1:
+            locations[missing[0]] = self._lookup_point(missing[0])
+        elif missing:
+            with ThreadPoolExecutor(max_workers=min(self.geocode_workers, len(missing))) as executor:
+                lookup_point = metrics.in_current_context(self._lookup_point)
+                futures = [executor.submit(lookup_point, point) for point in missing]
+                for point, future in zip(missing, futures):
+                    locations[point] = future.result()
+
+        return locations
 
+    def _get_location_from_point(self, latitude, longitude):
+        response_dict = self._get_json(*self._location_point_request(latitude, longitude))
+        return self._parse_location_from_point(response_dict, latitude, longitude)
+
+    def _location_point_request(self, latitude, longitude):
         latitude, longitude = str(latitude), str(longitude)
         point_str = latitude + "," + longitude
 
-        url = "http://dev.virtualearth.net/REST/v1/Locations/{point}".format(point=point_str)
+        url = "{}/Locations/{}".format(self.base_url, point_str)
         params = {
             "key": self.key
         }
-        response_dict = requests.get(url, params).json()
-
-        # print(response_dict, sys.stderr)
+        return "locations_point", url, params
 
+    @staticmethod
+    def _parse_location_from_point(response_dict, latitude, longitude):
         try:
             location = response_dict["resourceSets"][0]["resources"][0]
         except IndexError:
@@ -390,11 +1048,37 @@ class BingMaps(object):
         return BingLocation.from_location_resource(location)
 
 
-    def get_transit_routes(self, source, destination, time=None):
-
+    def get_transit_routes(self, source, destination, time=None, max_routes=None, objective="time"):
+        """
+        Only the duration, fare and number of segments of the routes are read from the response right away.
+        The segments and their addresses are built the first time a route's segments or locations are read:
+        the points of all the returned routes are then reverse geocoded together, concurrently.
+
+        :param max_routes: number of routes to return, the best ones for `objective`. The other routes of the
+                           response are never built and their points never reverse geocoded.
+        :param objective: one of ranking.OBJECTIVES, e.g. "cost" keeps the cheapest routes
+        :rtype: list of BingTransitRoute
+        """
         time = time or BingDateTime.now()
 
-        url = "http://dev.virtualearth.net/REST/v1/Routes/Transit"
+        response_dict = self._get_json(*self._transit_request(source, destination, time))
+        #print(dict_to_pretty_str(response_dict))
+
+        routes = _select_transit_routes(response_dict["resourceSets"][0]["resources"], max_routes, objective)
+
+        get_locations = _call_once(lambda: self.get_locations_from_points(_get_transit_route_points(routes)))
+
+        transit_routes = []
+        for route in routes:
+            route_segments = _TransitRouteSegments(
+                BingDuration.from_value_and_unit(route["travelDuration"], route["durationUnit"]),
+                _get_transit_route_summaries(route),
+                load=functools.partial(self._load_transit_segments, route, get_locations))
+            transit_routes.append(BingTransitRoute.from_route_segments(route_segments, time))
+        return transit_routes
+
+    def _transit_request(self, source, destination, time):
+        url = self.base_url + "/Routes/Transit"
         params = {
             "wayPoint.1": source,
             "wayPoint.2": destination,
@@ -406,88 +1090,102 @@ class BingMaps(object):
             "optimize": "time",
             "key": self.key
         }
-        response_dict = requests.get(url, params).json()
-        #print(dict_to_pretty_str(response_dict))
+        return "transit", url, params
 
+    def _build_transit_routes(self, routes, locations, time):
+        """
+        :param routes: route resources of a Routes/Transit response
+        :param locations: location of every point returned by _get_transit_route_points, keyed by rounded point
+        :param time: departure time of the routes
+        :rtype: list of BingTransitRoute
+        """
         all_routes = []
-        routes = response_dict["resourceSets"][0]["resources"]
-
         for route in routes:
-            segments = route["routeLegs"][0]["itineraryItems"]
-
-            begin_coords = route["routeLegs"][0]["actualStart"]["coordinates"]
-            end_coords = route["routeLegs"][0]["actualEnd"]["coordinates"]
-
-            start_location = self.get_location_from_point(begin_coords[0], begin_coords[1])
-            end_location = self.get_location_from_point(end_coords[0], end_coords[1])
-
-            result = []
-            for segmentItem in segments:
-                try:
-                    is_walk = segmentItem["iconType"].lower() == "walk"
-                except IndexError:
-                    is_walk = 'childItineraryItems' not in segmentItem
-
-                if is_walk:
-                    walk_segment = BingWalkSegment()
-                    coords = segmentItem["maneuverPoint"]["coordinates"]
-                    walk_segment.start_location = self.get_location_from_point(coords[0], coords[1])
-                    walk_segment.manType = segmentItem["details"][0]["maneuverType"]
-                    walk_segment.text = segmentItem["instruction"]["text"]
-                    walk_segment.dist = segmentItem["travelDistance"]
-                    walk_segment.duration = BingDuration.from_value_and_unit(segmentItem["travelDuration"], route["durationUnit"])
-                    walk_segment.cost = 0
-                    walk_segment.agency = "walk"
-                    result.append(walk_segment)
-                else:
-                    transport_segment = BingTransportSegment()
-                    transport_segment.manType = segmentItem["details"][0]["maneuverType"]
-                    transport_segment.dist = segmentItem["travelDistance"]
-                    transport_segment.duration = BingDuration.from_value_and_unit(segmentItem["travelDuration"], route["durationUnit"])
-                    transport_segment.text = segmentItem["instruction"]["text"]
-
-                    transport_segment.agency = segmentItem["transitLine"]["agencyName"]
-
-                    if transport_segment.dist > 10:
-                        transport_segment.cost = 2.75
-                    else:
-                        transport_segment.cost = 3.75
-                    depart_itinerary = segmentItem["childItineraryItems"][0]
-                    arrive_itinerary = segmentItem["childItineraryItems"][-1]
-
-                    depart_time = BingDateTime.from_bing_api_time(depart_itinerary["time"])
-                    depart = BingDepartArrive(type="depart", time=depart_time)
-                    depart.manType = depart_itinerary["details"][0]["maneuverType"]
-                    depart.names = depart_itinerary["instruction"]["text"]
-                    depart_coords = depart_itinerary["maneuverPoint"]["coordinates"]
-                    depart.coords = self.get_location_from_point(depart_coords[0], depart_coords[1])
-
-                    arrive_time = BingDateTime.from_bing_api_time(depart_itinerary["time"])
-                    arrive = BingDepartArrive(type="arrive", time=arrive_time)
-                    arrive.manType = arrive_itinerary["details"][0]["maneuverType"]
-                    arrive.names = arrive_itinerary["instruction"]["text"]
-                    arrive_coords = arrive_itinerary["maneuverPoint"]["coordinates"]
-                    arrive.coords = self.get_location_from_point(arrive_coords[0], arrive_coords[1])
-
-                    transport_segment.depart_details = depart
-                    transport_segment.arrive_details = arrive
-
-                    result.append(transport_segment)
+            segments, start_location, end_location = self._build_transit_segments(route, locations)
             total_duration = BingDuration.from_value_and_unit(route["travelDuration"], route["durationUnit"])
-            transit_route = BingTransitRoute(result, total_duration, start_location, end_location, time)
+            transit_route = BingTransitRoute(segments, total_duration, start_location, end_location, time)
             all_routes.append(transit_route)
 
         return all_routes
 
+    def _load_transit_segments(self, route, get_locations):
+        return self._build_transit_segments(route, get_locations())
+
+    def _build_transit_segments(self, route, locations):
+        """
+        :param route: route resource of a Routes/Transit response
+        :param locations: location of every point of the route, keyed by rounded point
+        :return: segments, start location and end location of the route
+        """
+        def _location(coords):
+            return locations[_quantize_point(coords[0], coords[1], self.point_precision)]
+
+        start_location = _location(route["routeLegs"][0]["actualStart"]["coordinates"])
+        end_location = _location(route["routeLegs"][0]["actualEnd"]["coordinates"])
+
+        result = []
+        for segmentItem in route["routeLegs"][0]["itineraryItems"]:
+            agency, cost = _get_itinerary_item_agency_and_cost(segmentItem)
+
+            if _is_walk_itinerary_item(segmentItem):
+                walk_segment = BingWalkSegment(
+                    start_location=_location(segmentItem["maneuverPoint"]["coordinates"]),
+                    mantype=segmentItem["details"][0]["maneuverType"],
+                    text=segmentItem["instruction"]["text"],
+                    dist=segmentItem["travelDistance"],
+                    duration=BingDuration.from_value_and_unit(segmentItem["travelDuration"], route["durationUnit"]),
+                    cost=cost)
+                result.append(walk_segment)
+            else:
+                depart_itinerary = segmentItem["childItineraryItems"][0]
+                arrive_itinerary = segmentItem["childItineraryItems"][-1]
+
+                depart_time = BingDateTime.from_bing_api_time(depart_itinerary["time"])
+                depart = BingDepartArrive(type="depart", time=depart_time,
+                                          mt=depart_itinerary["details"][0]["maneuverType"],
+                                          names=sys.intern(depart_itinerary["instruction"]["text"]),
+                                          coords=_location(depart_itinerary["maneuverPoint"]["coordinates"]))
+
+                arrive_time = BingDateTime.from_bing_api_time(depart_itinerary["time"])
+                arrive = BingDepartArrive(type="arrive", time=arrive_time,
+                                          mt=arrive_itinerary["details"][0]["maneuverType"],
+                                          names=sys.intern(arrive_itinerary["instruction"]["text"]),
+                                          coords=_location(arrive_itinerary["maneuverPoint"]["coordinates"]))
+
+                transport_segment = BingTransportSegment(
+                    depart_details=depart,
+                    arrive_details=arrive,
+                    mantype=segmentItem["details"][0]["maneuverType"],
+                    text=segmentItem["instruction"]["text"],
+                    dist=segmentItem["travelDistance"],
+                    duration=BingDuration.from_value_and_unit(segmentItem["travelDuration"], route["durationUnit"]),
+                    cost=cost,
+                    agency=agency)
+
+                result.append(transport_segment)
+
+        return result, start_location, end_location
+
     def get_possible_locations_from_string(self, location_str):
         """
+        Results are served from the autocomplete cache when the query, or a shorter prefix of it whose results
+        still match the query, was looked up recently.
+
         :param location_str: Place we are trying to get concrete location for
         :type location_str: str
         :return: Returns list of tuples of location of highest confidence alongside their
         :rtype: [BingLocation, confidence_as_int]
         :raises: BingApiError if no valid location was returned
         """
-        locations = self._get_locations_for_query(location_str)
+        results = self.autocomplete_cache.get(location_str)
+        if results is None:
+            locations = self._get_locations_for_query(location_str)
+            results = self._possible_locations_from_query_results(locations)
+            self.autocomplete_cache.set(location_str, results)
+        return results
+
+    @staticmethod
+    def _possible_locations_from_query_results(locations):
         if not locations:
             raise BingApiError("No locations match the query string")
 
@@ -496,6 +1194,10 @@ class BingMaps(object):
 
     def get_driving_route(self, source_location, dest_location, departure_date_time=None):
         """
+        Driving routes are cached by rounded source and destination points and the `driving_time_bucket`
+        the departure time falls in. Only the distance and duration are cached, every call returns a new
+        route for the given locations.
+
         :param source_location:
         :type BingLocation
         :param dest_location:
@@ -504,7 +1206,39 @@ class BingMaps(object):
         :type BingDateTime
         :return:
         """
+        self._check_driving_route_args(source_location, dest_location, departure_date_time)
+
+        cache_key = self._driving_route_cache_key(source_location, dest_location, departure_date_time)
+
+        cached = self.driving_route_cache.get(cache_key)
+        if cached is None:
+            fetched_routes = []
+
+            def fetch():
+                if self.persistent_cache is not None:
+                    value = self.persistent_cache.get("driving", cache_key)
+                    if value is not None:
+                        self.driving_route_cache.set(cache_key, _driving_leg_from_persisted(value))
+                        return _driving_leg_from_persisted(value)
+
+                route = self._get_driving_route(source_location, dest_location, departure_date_time)
+                self.driving_route_cache.set(cache_key, (route.distance, route.duration))
+                if self.persistent_cache is not None:
+                    self.persistent_cache.set("driving", cache_key,
+                                              _driving_leg_to_persisted(route.distance, route.duration))
+                fetched_routes.append(route)
+                return route.distance, route.duration
+
+            # callers that shared the call of another one get a route for their own locations, as from the cache
+            cached = self.singleflight.do("driving", cache_key, fetch)
+            if fetched_routes:
+                return fetched_routes[0]
 
+        distance, duration = cached
+        return BingDrivingRoute(source_location, dest_location, distance=distance, travel_duration=duration)
+
+    @staticmethod
+    def _check_driving_route_args(source_location, dest_location, departure_date_time):
         try:
             is_correct_type_or_err(source_location, BingLocation)
             is_correct_type_or_err(dest_location, BingLocation)
@@ -513,8 +1247,19 @@ class BingMaps(object):
         except TypeError as e:
             raise BingApiError(e)
 
+    def _driving_route_cache_key(self, source_location, dest_location, departure_date_time):
+        departure = departure_date_time or BingDateTime.now()
+        return (_quantize_point(*source_location.point_list, precision=self.point_precision),
+                _quantize_point(*dest_location.point_list, precision=self.point_precision),
+                departure.epoch_ms // (1000 * self.driving_time_bucket))
+
+    def _get_driving_route(self, source_location, dest_location, departure_date_time=None):
+        response_dict = self._get_json(*self._driving_request(source_location, dest_location, departure_date_time))
+        return self._parse_driving_route(response_dict, source_location, dest_location, departure_date_time)
+
+    def _driving_request(self, source_location, dest_location, departure_date_time=None):
         # driving route example https://docs.microsoft.com/en-us/bingmaps/rest-services/examples/driving-route-example
-        url = "http://dev.virtualearth.net/REST/V1/Routes/Driving"
+        url = self.base_url + "/Routes/Driving"
         params = {
             "waypoint.0": source_location.point_as_str,  # source
             "waypoint.1": dest_location.point_as_str,    # destination
@@ -524,10 +1269,13 @@ class BingMaps(object):
         }
 
         if departure_date_time:
-            params["datetime"] = str(departure_date_time),
+            params["datetime"] = str(departure_date_time)
             params["timeType"] = "Departure"
 
-        response_dict = requests.get(url, params).json()
+        return "driving", url, params
+
+    @staticmethod
+    def _parse_driving_route(response_dict, source_location, dest_location, departure_date_time=None):
         try:
             route = response_dict["resourceSets"][0]["resources"][0]
         except IndexError:
@@ -541,10 +1289,146 @@ class BingMaps(object):
                                                             dest_location=dest_location,
                                                             departure_date_time=departure_date_time)
 
+    def get_driving_distance_matrix(self, source_locations, dest_location, start_time=None):
+        """
+        Get the driving distance and duration from many sources to one destination with a single
+        Distance Matrix request (one request per `DEFAULT_MATRIX_MAX_ORIGINS` distinct sources).
+
+        Unlike get_driving_route, which uses the traffic at the departure time of each route, the durations of
+        a matrix all use the traffic predicted at the single `start_time`. Callers pass the earliest departure
+        of their routes, so the later routes are priced with the traffic of up to a few minutes earlier.
+
+        :param source_locations: sources of the routes
+        :type source_locations: list of BingLocation
+        :param dest_location: destination of all the routes
+        :type dest_location: BingLocation
+        :param start_time: departure time whose predicted traffic the durations use, no traffic if None
+        :type start_time: BingDateTime
+        :return: (distance, duration) for each source, in order, or None if Bing found no route for it
+        :rtype: list of (BingDistance, BingDuration)
+        :raises: BingApiError if the request failed
+        """
+        origins, origin_indices = self._get_matrix_origins(source_locations, dest_location)
+
+        results = []
+        for chunk_start in range(0, len(origins), DEFAULT_MATRIX_MAX_ORIGINS):
+            chunk = origins[chunk_start:chunk_start + DEFAULT_MATRIX_MAX_ORIGINS]
+            response_dict = self._get_json(*self._distance_matrix_request(chunk, dest_location, start_time))
+            results.extend(self._parse_distance_matrix(response_dict, len(chunk), dest_location))
+
+        return [results[index] for index in origin_indices]
+
+    def _get_matrix_origins(self, source_locations, dest_location):
+        """
+        :return: the distinct rounded source points, and the index in them of each source location
+        """
+        try:
+            for location in source_locations:
+                is_correct_type_or_err(location, BingLocation)
+            is_correct_type_or_err(dest_location, BingLocation)
+        except TypeError as e:
+            raise BingApiError(e)
+
+        origins = []
+        origin_index = {}
+        for location in source_locations:
+            point = _quantize_point(*location.point_list, precision=self.point_precision)
+            if point not in origin_index:
+                origin_index[point] = len(origins)
+                origins.append(point)
+
+        return origins, [origin_index[_quantize_point(*location.point_list, precision=self.point_precision)]
+                         for location in source_locations]
+
+    def _distance_matrix_request(self, origins, dest_location, start_time=None):
+        # distance matrix example https://docs.microsoft.com/en-us/bingmaps/rest-services/routes/calculate-a-distance-matrix
+        url = self.base_url + "/Routes/DistanceMatrix"
+        params = {
+            "origins": ";".join("{},{}".format(*point) for point in origins),
+            "destinations": dest_location.point_as_str,
+            "travelMode": "driving",
+            "distanceUnit": "mi",
+            "timeUnit": "second",
+            "key": self.key
+        }
+
+        if start_time:
+            # ISO 8601 with the UTC offset of the server, a start time makes Bing use predictive traffic
+            params["startTime"] = datetime.datetime.fromtimestamp(start_time.epoch_ms / 1000.0).astimezone() \
+                .isoformat(timespec="seconds")
+
+        return "distance_matrix", url, params
+
+    @staticmethod
+    def _parse_distance_matrix(response_dict, num_origins, dest_location):
+        try:
+            cells = response_dict["resourceSets"][0]["resources"][0]["results"]
+        except (IndexError, KeyError):
+            error = response_dict.get("errorDetails",
+                                      "No distance matrix found for dest '{}'.".format(dest_location.address_str))
+            raise BingApiError(error)
+
+        results = [None] * num_origins
+        for cell in cells:
+            # bing reports -1 for the pairs it could not route
+            if cell["travelDistance"] < 0 or cell["travelDuration"] < 0:
+                continue
+            results[cell["originIndex"]] = (BingDistance(value=cell["travelDistance"], unit="Mile"),
+                                            BingDuration.from_value_and_unit(cell["travelDuration"], "second"))
+        return results
+
+_default_bing_maps = None
+_default_bing_maps_lock = threading.Lock()
+
+
+def get_default_bing_maps():
+    """
+    :return: the process wide client, created on first use
+    :rtype: BingMaps
+    """
+    global _default_bing_maps
+
+    if _default_bing_maps is None:
+        with _default_bing_maps_lock:
+            if _default_bing_maps is None:
+                bing_maps = BingMaps(**_get_bing_maps_options_from_env())
+                bing_maps.warm_start()
+                _default_bing_maps = bing_maps
+    return _default_bing_maps
+
+
+def _get_bing_maps_options_from_env():
+    """
+    BING_MAPS_URL points the client at another server, e.g. the stub server of the benchmarks.
+    BING_MAPS_RECORD_DIR and BING_MAPS_REPLAY_DIR record Bing responses to, or replay them from, a directory.
+    BING_MAPS_RATE_LIMIT limits the calls to that many per second, BING_MAPS_RATE_BURST sets the burst size.
+    Both are shared evenly by the BING_MAPS_RATE_LIMIT_WORKERS processes of the server, which gunicorn.conf.py
+    sets to its number of workers, so that the limit holds for the whole server.
+    BING_MAPS_CACHE_PATH keeps the results of the lookups in a database at that path, across restarts.
+    """
+    options = {}
+    if os.environ.get("BING_MAPS_URL"):
+        options["base_url"] = os.environ["BING_MAPS_URL"]
+    if os.environ.get("BING_MAPS_RECORD_DIR"):
+        options["record_dir"] = os.environ["BING_MAPS_RECORD_DIR"]
+    if os.environ.get("BING_MAPS_REPLAY_DIR"):
+        options["replay_dir"] = os.environ["BING_MAPS_REPLAY_DIR"]
+    if os.environ.get("BING_MAPS_RATE_LIMIT"):
+        # every process has its own limiter, each one gets its share of the limit
+        processes = max(int(os.environ.get("BING_MAPS_RATE_LIMIT_WORKERS", 1)), 1)
+        burst = float(os.environ.get("BING_MAPS_RATE_BURST", 0)) / processes
+        options["rate_limiter"] = rate_limit.RateLimiter(float(os.environ["BING_MAPS_RATE_LIMIT"]) / processes,
+                                                         burst=max(burst, 1) if burst else None)
+    if os.environ.get("BING_MAPS_CACHE_PATH"):
+        options["persistent_cache"] = PersistentCache(os.environ["BING_MAPS_CACHE_PATH"],
+                                                      ttls={"driving": DEFAULT_DRIVING_ROUTE_CACHE_TTL})
+    return options
+
+
 def main_method():
     # run python common/bing_maps.py
 
-    map_api = BingMaps()
+    map_api = get_default_bing_maps()
 
     query = input("Enter the query string: ").strip() or "space needle"
     print([(tup[0].address_str, tup[1]) for tup in map_api.get_possible_locations_from_string(query)])
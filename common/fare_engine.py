@@ -0,0 +1,48 @@
+# Batched version of the fare estimates in common/rideshare_estimates.py, for pricing many legs at once.
+
+from common.rideshare_estimates import LyftEstimate, UberEstimate
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for batch pricing
+    np = None
+
+RIDESHARE_ESTIMATES = (LyftEstimate, UberEstimate)
+
+
+def estimate_fares(distances, durations, estimates=RIDESHARE_ESTIMATES):
+    """
+    Price many (distance, duration) legs for every provider in one pass. Gives the same fares as calling
+    `estimate_fare` of each estimate class on every leg.
+
+    :param distances: distance of each leg in miles
+    :type distances: numpy.ndarray or sequence of float
+    :param durations: duration of each leg in seconds
+    :type durations: numpy.ndarray or sequence of float
+    :param estimates: fare estimate classes to price the legs with
+    :return: fare of each leg, keyed by the name of the estimate class ("lyft", "uberx")
+    :rtype: dict of str to numpy.ndarray
+    """
+    if np is None:
+        raise ImportError("numpy is required for batch fare estimates, run `pip install numpy`.")
+
+    distances = np.asarray(distances, dtype=np.float64)
+    durations = np.asarray(durations, dtype=np.float64)
+    if distances.shape != durations.shape:
+        raise ValueError("distances and durations must have the same shape, got {} and {}."
+                         .format(distances.shape, durations.shape))
+
+    minutes = durations / 60.0
+
+    fares = {}
+    for estimate in estimates:
+        # same order of operations as the scalar estimate, so the results are identical.
+        fare = distances * estimate.cost_per_mile
+        fare += minutes * estimate.cost_per_minute
+        fare += estimate.fees()
+        np.maximum(fare, estimate.min_fare, out=fare)
+        if estimate.max_fare is not None:
+            np.minimum(fare, estimate.max_fare, out=fare)
+        fares[estimate.name] = fare
+
+    return fares
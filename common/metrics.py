@@ -0,0 +1,256 @@
+# In process metrics of the Bing calls and of the request handlers, exposed in the Prometheus text format.
+
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+DEFAULT_CALL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# (metric name, key of BingMaps.cache_stats(), help) of the gauges rendered for every cache
+CACHE_GAUGES = (
+    ("bing_cache_size", "size", "Number of entries in the cache."),
+    ("bing_cache_hit_ratio", "hit_ratio", "Fraction of the cache lookups that were hits."),
+)
+
+_metrics = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """
+        Monotonic counter, one value per combination of label values.
+    """
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Histogram(object):
+    """
+        Cumulative histogram with fixed buckets, one per combination of label values.
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # label values to [bucket counts, sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts_sum = self._values.get(key)
+            if counts_sum is None:
+                counts_sum = self._values[key] = [[0] * len(self.buckets), 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts_sum[0][index] += 1
+                    break
+            counts_sum[1] += value
+
+    def count(self, **labels):
+        counts_sum = self._values.get(tuple(labels[name] for name in self.labelnames))
+        return sum(counts_sum[0]) if counts_sum else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + "_bucket", labels + [("le", _format_value(bound))], cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+
+UPSTREAM_LATENCY = Histogram("bing_request_duration_seconds", "Latency of the Bing Maps API calls.",
+                             ["endpoint"])
+UPSTREAM_ERRORS = Counter("bing_request_errors_total", "Bing Maps API calls that failed or returned an error status.",
+                          ["endpoint"])
+REQUEST_LATENCY = Histogram("request_duration_seconds", "Latency of the request handlers.", ["handler"])
+REQUEST_UPSTREAM_CALLS = Histogram("request_upstream_calls", "Bing Maps API calls made by a single request.",
+                                   ["handler"], buckets=DEFAULT_CALL_COUNT_BUCKETS)
+STAGE_LATENCY = Histogram("request_stage_duration_seconds", "Latency of the stages of the request handlers.",
+                          ["handler", "stage"])
+
+
+class RequestStats(object):
+    """
+        Counters of a single request, shared by every thread and task working on it.
+    """
+
+    def __init__(self, handler, call_budget=None):
+        """
+        :param call_budget: number of Bing calls the request should make at most, unlimited if None. Calls are
+                            not refused once it is spent, optional work checks is_over_budget and is skipped.
+        """
+        self.handler = handler
+        self.call_budget = call_budget
+        self.upstream_calls = 0
+        self._lock = threading.Lock()
+
+    def add_upstream_call(self):
+        with self._lock:
+            self.upstream_calls += 1
+
+    def is_over_budget(self):
+        return self.call_budget is not None and self.upstream_calls >= self.call_budget
+
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def get_request_stats():
+    """
+    :return: stats of the request being handled, None outside of track_request
+    :rtype: RequestStats
+    """
+    return _request_stats.get()
+
+
+def is_over_budget():
+    """
+    :return: whether the request being handled has spent its Bing call budget, False outside of track_request
+    """
+    stats = _request_stats.get()
+    return stats is not None and stats.is_over_budget()
+
+
+@contextmanager
+def track_request(handler, call_budget=None):
+    """
+    Time the request handled inside the block and count the Bing calls it makes, including the calls made
+    by functions wrapped with in_current_context and by asyncio tasks it creates.
+
+    :param call_budget: see RequestStats
+    """
+    stats = RequestStats(handler, call_budget)
+    token = _request_stats.set(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        REQUEST_LATENCY.observe(time.perf_counter() - start, handler=handler)
+        REQUEST_UPSTREAM_CALLS.observe(stats.upstream_calls, handler=handler)
+        _request_stats.reset(token)
+
+
+@contextmanager
+def time_stage(stage):
+    stats = _request_stats.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, handler=stats.handler if stats else "none", stage=stage)
+
+
+class UpstreamCall(object):
+    """
+        Outcome of the Bing call timed by time_upstream_call, set `failed` for a response with an error status.
+    """
+    __slots__ = ("failed",)
+
+    def __init__(self):
+        self.failed = False
+
+
+@contextmanager
+def time_upstream_call(endpoint):
+    """
+    Time the Bing call made inside the block. The call counts as one error if the block raises an exception,
+    or marks the yielded UpstreamCall as failed, or both.
+    """
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add_upstream_call()
+
+    call = UpstreamCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call.failed = True
+        raise
+    finally:
+        if call.failed:
+            UPSTREAM_ERRORS.inc(endpoint=endpoint)
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+
+
+def in_current_context(function):
+    """
+    :return: function that runs in a copy of the caller's context, so that the calls it makes from an executor
+             thread are counted towards the caller's request
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # a context can only be entered by one thread at a time
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+
+def render(cache_stats=None):
+    """
+    :param cache_stats: stats of the caches whose sizes and hit ratios are included, keyed by cache name,
+                        e.g. BingMaps.cache_stats()
+    :return: every metric in the Prometheus text exposition format
+    :rtype: str
+    """
+    lines = []
+    for metric in _metrics:
+        lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+        lines.append("# TYPE {} {}".format(metric.name, metric.type))
+        for name, labels, value in metric.samples():
+            lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+
+    if cache_stats:
+        for name, stat, documentation in CACHE_GAUGES:
+            lines.append("# HELP {} {}".format(name, documentation))
+            lines.append("# TYPE {} gauge".format(name))
+            for cache, stats in sorted(cache_stats.items()):
+                lines.append("{}{} {}".format(name, _format_labels([("cache", cache)]), _format_value(stats[stat])))
+
+    return "\n".join(lines) + "\n"
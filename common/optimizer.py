@@ -1,51 +1,190 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from common.bing_maps import (BingLocation, BingDateTime, RideShareRoute, BingTransportSegment, BingComplexRoute,
+                              BingApiError, BingRateLimitError, get_default_bing_maps)
+from common import metrics
+from common import rate_limit
+from common import ranking
+from common.util import is_correct_type_or_err
 
-from common.bing_maps import (BingMaps, BingLocation, BingDateTime, RideShareRoute, BingTransitRoute,
-                              BingTransportSegment, BingComplexRoute)
-from common.util import dict_to_pretty_str, is_correct_type_or_err
+DEFAULT_HYBRID_WORKERS = 8
+
+SKIPPED_HYBRID_CANDIDATES = metrics.Counter("hybrid_candidates_skipped_total",
+                                            "Hybrid route candidates not evaluated because the request spent its "
+                                            "Bing call budget or was rate limited.", ["handler"])
+
+
+def _skip_hybrid_candidates(count=1):
+    stats = metrics.get_request_stats()
+    SKIPPED_HYBRID_CANDIDATES.inc(count, handler=stats.handler if stats else "none")
+
+
+def _get_earliest_departure(candidates):
+    """
+    :param candidates: list of (index of the transit route, (transit route, rideshare source, rideshare depart time))
+    :return: earliest rideshare departure of the candidates, None if there are none
+    :rtype: BingDateTime
+    """
+    return min((candidate[2] for _, candidate in candidates), key=lambda depart_time: depart_time.epoch_ms,
+               default=None)
 
 
 class RouteOptimizer(object):
 
-    def __init__(self, source, dest, optimization_type, depart_time):
+    def __init__(self, source, dest, optimization_type, depart_time, bing_maps=None,
+                 hybrid_workers=DEFAULT_HYBRID_WORKERS, init_routes=True, max_transit_routes=None):
+        """
+        :param init_routes: fetch the rideshare and transit routes now, otherwise the caller fetches them
+                            with init_ride_share_routes and init_transit_routes, e.g. to stream them
+        :param max_transit_routes: number of transit routes to keep, the best ones for `optimization_type`, all
+                                   of them if None. Hybrid routes are only built from the kept transit routes.
+        """
         is_correct_type_or_err(source, BingLocation)
         is_correct_type_or_err(dest, BingLocation)
         is_correct_type_or_err(depart_time, BingDateTime)
 
-        if optimization_type.lower() not in ["cost", "time"]:
-            self.optimization_type = optimization_type
+        self.optimization_type = ranking.normalize_objective(optimization_type)
 
         self.origin_source = source
         self.final_dest = dest
 
-        self.bing_maps = BingMaps()
+        self.bing_maps = bing_maps or get_default_bing_maps()
         self.depart_time = depart_time
+        self.hybrid_workers = hybrid_workers
+        self.max_transit_routes = max_transit_routes
 
         self.uber_route = None
         self.lyft_route = None
-        self._init_routes()
+        self.basic_transit_routes = None
+        if init_routes:
+            self.init_ride_share_routes()
+            self.init_transit_routes()
 
 
-    def _init_routes(self):
-        routes = RideShareRoute.from_source_dest(self.origin_source, self.final_dest, self.depart_time)
+    def init_ride_share_routes(self):
+        routes = RideShareRoute.from_source_dest(self.origin_source, self.final_dest, self.depart_time,
+                                                 bing_maps=self.bing_maps)
         self.uber_route = routes["uber"]
         self.lyft_route = routes["lyft"]
 
-        transit_routes = self.bing_maps.get_transit_routes(self.origin_source.address_str, self.final_dest.address_str)
+    def init_transit_routes(self):
+        transit_routes = self.bing_maps.get_transit_routes(self.origin_source.address_str, self.final_dest.address_str,
+                                                           max_routes=self.max_transit_routes,
+                                                           objective=self.optimization_type)
         self.basic_transit_routes = transit_routes
 
 
     def get_simple_hybrid(self, transit_route):
-        def _replace_simple_complex_route(last_segment, possible_complex_routes, transit_route):
-            rs_source = last_segment.depart_details.coords
-            rs_depart_time = last_segment.depart_details.time
-            ride_share_route = RideShareRoute.from_source_dest(rs_source, self.final_dest, rs_depart_time)
-            # possible_complex_routes.append(BingComplexRoute([transit_route, ride_share_route["lyft"]]))
-            possible_complex_routes.append(BingComplexRoute([transit_route, ride_share_route["uber"]]))
-
-        if len(transit_route.segments) <= 1:
-            return []
-
-        possible_complex_routes = []
+        return self.get_simple_hybrids([transit_route])[0]
+
+    def get_simple_hybrids(self, transit_routes):
+        """
+        Get the transit + rideshare routes for several transit routes. The rideshare legs of every candidate
+        across all the transit routes share the same destination, so they are priced with a single distance
+        matrix request. If that fails, the legs are fetched as individual driving routes, at most
+        `hybrid_workers` at a time.
+
+        Hybrid routes are optional: once the Bing call budget of the request is spent, or when a call is
+        refused by the rate limiter, the candidates still needing a call are skipped. Their calls are sent
+        with the lowest priority.
+
+        :param transit_routes: transit routes to build hybrid routes from
+        :type transit_routes: list of BingTransitRoute
+        :return: for each transit route, its hybrid routes in the same order as the serial computation
+        :rtype: list of list of BingComplexRoute
+        """
+        candidates, legs = self._get_hybrid_candidates_and_legs(transit_routes)
+
+        if legs.count(None) <= 1 or self.hybrid_workers <= 1:
+            complex_routes = [self._evaluate_hybrid(candidate, leg) for (_, candidate), leg in zip(candidates, legs)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.hybrid_workers, len(candidates))) as executor:
+                complex_routes = list(executor.map(metrics.in_current_context(self._evaluate_hybrid),
+                                                   [candidate for _, candidate in candidates], legs))
+
+        results = [[] for _ in transit_routes]
+        for (index, _), complex_route in zip(candidates, complex_routes):
+            if complex_route is not None:
+                results[index].append(complex_route)
+        return results
+
+    def iter_simple_hybrids(self, transit_routes):
+        """
+        Same as get_simple_hybrids, but yields every hybrid route as soon as it is ready.
+
+        :return: generator of (index of the transit route in `transit_routes`, BingComplexRoute)
+        """
+        candidates, legs = self._get_hybrid_candidates_and_legs(transit_routes)
+
+        if legs.count(None) <= 1 or self.hybrid_workers <= 1:
+            for (index, candidate), leg in zip(candidates, legs):
+                complex_route = self._evaluate_hybrid(candidate, leg)
+                if complex_route is not None:
+                    yield index, complex_route
+            return
+
+        evaluate_hybrid = metrics.in_current_context(self._evaluate_hybrid)
+        with ThreadPoolExecutor(max_workers=min(self.hybrid_workers, len(candidates))) as executor:
+            futures = {executor.submit(evaluate_hybrid, candidate, leg): index
+                       for (index, candidate), leg in zip(candidates, legs)}
+            for future in as_completed(futures):
+                if future.result() is not None:
+                    yield futures[future], future.result()
+
+    def _get_hybrid_candidates_and_legs(self, transit_routes):
+        """
+        :return: list of (index of the transit route, candidate) and, for each candidate, the (distance, duration)
+                 of its rideshare leg from the distance matrix or None if it must be fetched on its own
+        """
+        candidates = [(index, candidate) for index, transit_route in enumerate(transit_routes)
+                      for candidate in self._get_hybrid_candidates(transit_route)]
+
+        if candidates and metrics.is_over_budget():
+            _skip_hybrid_candidates(len(candidates))
+            return [], []
+
+        try:
+            with rate_limit.call_priority(rate_limit.PRIORITY_HYBRID):
+                legs = self.bing_maps.get_driving_distance_matrix([candidate[1] for _, candidate in candidates],
+                                                                  self.final_dest, _get_earliest_departure(candidates))
+        except BingRateLimitError:
+            # fetching the legs one by one would only wait longer for the limiter
+            _skip_hybrid_candidates(len(candidates))
+            return [], []
+        except BingApiError:
+            legs = [None] * len(candidates)
+
+        return candidates, legs
+
+    def _evaluate_hybrid(self, candidate, leg):
+        """
+        :return: the hybrid route of the candidate, None if it was skipped
+        :rtype: BingComplexRoute
+        """
+        transit_route, rs_source, rs_depart_time = candidate
+        if leg is None:
+            if metrics.is_over_budget():
+                _skip_hybrid_candidates()
+                return None
+            try:
+                with rate_limit.call_priority(rate_limit.PRIORITY_HYBRID):
+                    ride_share_route = RideShareRoute.from_source_dest(rs_source, self.final_dest, rs_depart_time,
+                                                                       bing_maps=self.bing_maps)
+            except BingRateLimitError:
+                _skip_hybrid_candidates()
+                return None
+        else:
+            ride_share_route = RideShareRoute.from_distance_duration(rs_source, self.final_dest, leg[0], leg[1],
+                                                                     rs_depart_time)
+        # return BingComplexRoute([transit_route, ride_share_route["lyft"]])
+        return BingComplexRoute([transit_route, ride_share_route["uber"]])
+
+    @staticmethod
+    def _get_hybrid_candidates(transit_route):
+        """
+        :return: list of (transit route, rideshare source, rideshare depart time), one for each point of the
+                 transit route at which the rest of the trip could be replaced by a rideshare
+        """
+        candidates = []
         while len(transit_route.segments) > 1:
             # get last segment, this is the start of the rideshare.
             last_segment = transit_route.segments[-1]
@@ -55,20 +194,15 @@ class RouteOptimizer(object):
 
             # if there is another transport segment beforehand
             if isinstance(last_segment, BingTransportSegment):
-                _replace_simple_complex_route(last_segment, possible_complex_routes, transit_route)
+                candidates.append((transit_route, last_segment.depart_details.coords, last_segment.depart_details.time))
             else:
-                del last_segment
                 # in this case last segment is walk segment... so use previous transit segment to determine departure time.
                 try:
                     second_to_last_segment = transit_route.segments[-1]
                 except IndexError:
                     continue
                 if isinstance(second_to_last_segment, BingTransportSegment):
-                    rs_source = second_to_last_segment.arrive_details.coords
-                    rs_depart_time = second_to_last_segment.arrive_details.time
-                    ride_share_route = RideShareRoute.from_source_dest(rs_source, self.final_dest, rs_depart_time)
-                    # possible_complex_routes.append(BingComplexRoute([transit_route, ride_share_route["lyft"]]))
-                    possible_complex_routes.append(BingComplexRoute([transit_route, ride_share_route["uber"]]))
-
-        return possible_complex_routes
+                    candidates.append((transit_route, second_to_last_segment.arrive_details.coords,
+                                       second_to_last_segment.arrive_details.time))
 
+        return candidates
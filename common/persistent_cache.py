@@ -0,0 +1,255 @@
+# On disk cache of Bing results shared by the worker processes of a host, so that restarts start warm.
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+DEFAULT_PERSISTENT_CACHE_SIZE = 500000
+DEFAULT_PERSISTENT_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+DEFAULT_COMPACT_EVERY = 1000  # writes
+DEFAULT_FLUSH_EVERY = 200  # reads
+DEFAULT_BUSY_TIMEOUT = 5  # seconds
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_by_use ON entries (last_used);
+"""
+
+
+class PersistentCache(object):
+    """
+        SQLite backed key/value cache with a per-entry time to live, bounded to `max_size` entries.
+
+        Keys and values are JSON values, grouped in namespaces that each have their own time to live. The
+        database is in WAL mode, so that the worker processes of a host can read it while one of them writes,
+        and every thread of every process has its own connection. Reads are counted in memory and written
+        back in batches, they rank the entries for compaction and for warm starts. The number of entries is
+        counted when the cache is opened and when it is compacted, and kept up to date by the writes of this
+        process in between, so that stats does not scan the table.
+
+        Disk errors are never raised: a failed read is a miss and a failed write is dropped.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_PERSISTENT_CACHE_SIZE, ttl=DEFAULT_PERSISTENT_CACHE_TTL, ttls=None,
+                 compact_every=DEFAULT_COMPACT_EVERY, flush_every=DEFAULT_FLUSH_EVERY):
+        """
+        :param path: file of the database, created if missing
+        :param max_size: number of entries kept by compact, the least recently used ones are deleted first
+        :param ttl: seconds an entry is served for, unless its namespace is in `ttls`
+        :param ttls: seconds an entry is served for, keyed by namespace
+        :param compact_every: number of writes of this process between two compactions
+        :param flush_every: number of reads of this process between two writes of their counts
+        """
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.compact_every = compact_every
+        self.flush_every = flush_every
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._used = {}  # (namespace, key) -> reads since the last flush
+        self._reads = 0
+        self._writes = 0
+        self._size = 0
+
+        self._connection().executescript(_SCHEMA)
+        self._count()
+
+    def _connection(self):
+        # connections must not cross a fork, nor be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=DEFAULT_BUSY_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _count(self):
+        try:
+            size = self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self._size = size
+
+    @staticmethod
+    def _encode_key(key):
+        return json.dumps(key, separators=(",", ":"))
+
+    def get(self, namespace, key):
+        """
+        :param key: JSON serializable key, tuples are stored as lists
+        :return: the value stored for the key, None if it is missing or expired
+        """
+        encoded_key = self._encode_key(key)
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, encoded_key, time.time())).fetchone()
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used[(namespace, encoded_key)] = self._used.get((namespace, encoded_key), 0) + 1
+            self._reads += 1
+            should_flush = self._reads >= self.flush_every
+
+        if should_flush:
+            self.flush()
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value):
+        """
+        :param key: JSON serializable key
+        :param value: JSON serializable value
+        """
+        now = time.time()
+        row = (json.dumps(value, separators=(",", ":")), now + self.ttls.get(namespace, self.ttl), now, namespace,
+               self._encode_key(key))
+        try:
+            connection = self._connection()
+            # an update keeps the hits of the entry, and tells whether the entry is new
+            is_new = connection.execute(
+                "UPDATE entries SET value = ?, expires_at = ?, last_used = ? WHERE namespace = ? AND key = ?",
+                row).rowcount == 0
+            if is_new:
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (value, expires_at, last_used, namespace, key) "
+                    "VALUES (?, ?, ?, ?, ?)", row)
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return
+
+        with self._lock:
+            self._writes += 1
+            if is_new:
+                self._size += 1
+            should_compact = self._writes % self.compact_every == 0
+
+        if should_compact:
+            self.compact()
+
+    def flush(self):
+        """
+        Write the read counts of this process to the database.
+        """
+        with self._lock:
+            used, self._used = self._used, {}
+            self._reads = 0
+        if not used:
+            return
+
+        now = time.time()
+        try:
+            self._connection().executemany(
+                "UPDATE entries SET hits = hits + ?, last_used = ? WHERE namespace = ? AND key = ?",
+                [(count, now, namespace, key) for (namespace, key), count in used.items()])
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+
+    def compact(self):
+        """
+        Delete the expired entries, then the least recently used ones beyond `max_size`.
+        """
+        self.flush()
+        try:
+            connection = self._connection()
+            # IMMEDIATE takes the write lock up front, so that two processes do not compact at once
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+                connection.execute(
+                    "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY last_used DESC "
+                    "LIMIT -1 OFFSET ?)", (self.max_size,))
+                # the writes of the other processes are only counted here
+                size = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return
+
+        with self._lock:
+            self._size = size
+
+    def hottest(self, namespace, limit):
+        """
+        :return: list of (key, value) of up to `limit` unexpired entries of the namespace, most read first
+        """
+        try:
+            rows = self._connection().execute(
+                "SELECT key, value FROM entries WHERE namespace = ? AND expires_at > ? "
+                "ORDER BY hits DESC, last_used DESC LIMIT ?", (namespace, time.time(), limit)).fetchall()
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return []
+        return [(json.loads(key), json.loads(value)) for key, value in rows]
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM entries")
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._used = {}
+            self._reads = 0
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+            self.errors = 0
+
+    def __len__(self):
+        """
+        :return: exact number of entries of every process, counted on the table
+        """
+        try:
+            return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def stats(self):
+        """
+        :return: dict of size as counted by this process, hits, misses, disk errors and hit ratio of this process
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_ratio": float(self.hits) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,71 @@
+# Ranking of the recommended routes on compact (duration, cost) records, before the routes are serialized.
+
+OBJECTIVES = ("time", "cost", "blend")
+OBJECTIVE_ALIASES = {"price": "cost"}  # the frontend optimises for "price"
+DEFAULT_VALUE_OF_TIME = 20.0  # dollars per hour, converts durations into costs for the "blend" objective
+
+
+def pareto_front(records):
+    """
+    :param records: list of (duration, cost, index) records
+    :return: the records that no other record dominates, i.e. is at least as fast and as cheap as, sorted by
+             duration. Of several equal records only the one with the lowest index is kept. O(n log n).
+    """
+    front = []
+    best_cost = float("inf")
+    # by duration then cost, so a record is dominated iff an earlier record is at least as cheap
+    for record in sorted(records):
+        if record[1] < best_cost:
+            front.append(record)
+            best_cost = record[1]
+    return front
+
+
+def normalize_objective(objective):
+    """
+    :param objective: one of OBJECTIVES or OBJECTIVE_ALIASES, in any case
+    :return: the objective as one of OBJECTIVES
+    :raises: ValueError if it is not a known objective
+    """
+    objective = str(objective).lower()
+    objective = OBJECTIVE_ALIASES.get(objective, objective)
+    if objective not in OBJECTIVES:
+        raise ValueError("Unknown objective '{}', expected one of {}.".format(
+            objective, ", ".join(OBJECTIVES + tuple(OBJECTIVE_ALIASES))))
+    return objective
+
+
+def get_objective_key(objective, value_of_time=DEFAULT_VALUE_OF_TIME):
+    """
+    :param objective: one of OBJECTIVES
+    :param value_of_time: dollars per hour a "blend" ranking trades for time
+    :return: sort key of (duration, cost, index) records, best first
+    """
+    if objective == "time":
+        return lambda record: (record[0], record[1])
+    if objective == "cost":
+        return lambda record: (record[1], record[0])
+    if objective == "blend":
+        return lambda record: (record[1] + record[0] / 3600.0 * value_of_time, record[0])
+    raise ValueError("Unknown objective '{}', expected one of {}.".format(objective, ", ".join(OBJECTIVES)))
+
+
+def rank_routes(candidates, competitors=(), objective="time", max_routes=None, value_of_time=DEFAULT_VALUE_OF_TIME):
+    """
+    :param candidates: (duration in seconds, cost, index) of the routes to rank
+    :param competitors: (duration in seconds, cost) of the routes that are recommended anyway, a candidate they
+                        dominate, or equal, is dropped
+    :param objective: one of OBJECTIVES
+    :param max_routes: number of indices to return, all of them if None
+    :return: indices of the candidates on the cost/duration Pareto front, best first by the objective
+    :rtype: list of int
+    """
+    key = get_objective_key(objective, value_of_time)
+
+    # competitors have negative indices, so that they sort before the candidates they are equal to
+    records = list(candidates)
+    records.extend((duration, cost, -1 - index) for index, (duration, cost) in enumerate(competitors))
+
+    front = [record for record in pareto_front(records) if record[2] >= 0]
+    front.sort(key=key)
+    return [record[2] for record in front[:max_routes]]
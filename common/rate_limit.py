@@ -0,0 +1,147 @@
+# Client side limit of the rate of the Bing Maps API calls, shared by every request of the process.
+
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from common import metrics
+
+# lower values are served first when calls have to wait for a token
+PRIORITY_INTERACTIVE = 0  # autocomplete and point lookups a user is waiting on
+PRIORITY_ROUTES = 1  # transit and driving routes of a recommendation
+PRIORITY_HYBRID = 2  # exploration of hybrid routes, the first to wait when calls are scarce
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_ROUTES: "routes", PRIORITY_HYBRID: "hybrid"}
+
+ENDPOINT_PRIORITIES = {
+    "locations_query": PRIORITY_INTERACTIVE,
+    "locations_point": PRIORITY_INTERACTIVE,
+    "transit": PRIORITY_ROUTES,
+    "driving": PRIORITY_ROUTES,
+    "distance_matrix": PRIORITY_HYBRID,
+}
+
+DEFAULT_MAX_WAIT = 5  # seconds
+
+RATE_LIMIT_WAIT = metrics.Histogram("bing_rate_limit_wait_seconds", "Time Bing Maps API calls waited for a token.",
+                                    ["priority"])
+RATE_LIMIT_REJECTED = metrics.Counter("bing_rate_limit_rejected_total",
+                                      "Bing Maps API calls not sent because no token was available in time.",
+                                      ["priority"])
+
+_call_priority = contextvars.ContextVar("call_priority", default=None)
+
+
+def get_call_priority(endpoint):
+    """
+    :return: priority set by the innermost call_priority block, otherwise the priority of the endpoint
+    :rtype: int
+    """
+    priority = _call_priority.get()
+    if priority is None:
+        priority = ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_ROUTES)
+    return priority
+
+
+@contextmanager
+def call_priority(priority):
+    """
+    Send the Bing calls made inside the block with `priority`, whatever their endpoint.
+    """
+    token = _call_priority.set(priority)
+    try:
+        yield
+    finally:
+        _call_priority.reset(token)
+
+
+class RateLimiter(object):
+    """
+        Thread-safe token bucket. Tokens are added at `rate` per second up to `burst`, each call takes one.
+
+        When calls have to wait for a token they are served by priority: a call does not take a token while
+        a call with a higher priority, i.e. a lower value, is waiting for one. A call that cannot get a token
+        within `max_wait` seconds is not sent.
+    """
+
+    def __init__(self, rate, burst=None, max_wait=DEFAULT_MAX_WAIT):
+        """
+        :param rate: tokens added per second
+        :type rate: float
+        :param burst: maximum number of tokens, defaults to one second worth of tokens
+        :param max_wait: seconds a call waits for a token before giving up
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive.")
+
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.max_wait = max_wait
+
+        self.granted = {}
+        self.rejected = {}
+
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._waiting = {}  # priority -> number of waiting calls
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _has_waiting_before(self, priority):
+        return any(count for waiting_priority, count in self._waiting.items() if waiting_priority < priority)
+
+    def acquire(self, priority=PRIORITY_ROUTES, timeout=None):
+        """
+        :param priority: priority of the call, see PRIORITY_INTERACTIVE, PRIORITY_ROUTES and PRIORITY_HYBRID
+        :param timeout: seconds to wait for a token, defaults to `max_wait`
+        :return: True if a token was taken, False if none was available in time
+        :rtype: bool
+        """
+        start = time.monotonic()
+        deadline = start + (self.max_wait if timeout is None else timeout)
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+
+        with self._condition:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+
+                    if self._tokens >= 1 and not self._has_waiting_before(priority):
+                        self._tokens -= 1
+                        self.granted[priority] = self.granted.get(priority, 0) + 1
+                        break
+
+                    if now >= deadline:
+                        self.rejected[priority] = self.rejected.get(priority, 0) + 1
+                        RATE_LIMIT_REJECTED.inc(priority=priority_name)
+                        return False
+
+                    if self._tokens >= 1:
+                        # a token is there but a call with a higher priority takes it first, it notifies us
+                        self._condition.wait(deadline - now)
+                    else:
+                        self._condition.wait(min(deadline - now, (1 - self._tokens) / self.rate))
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+        RATE_LIMIT_WAIT.observe(time.monotonic() - start, priority=priority_name)
+        return True
+
+    def stats(self):
+        """
+        :return: dict of available tokens, waiting calls, and calls granted and rejected by priority name
+        """
+        with self._condition:
+            self._refill(time.monotonic())
+            return {
+                "tokens": self._tokens,
+                "waiting": sum(self._waiting.values()),
+                "granted": {PRIORITY_NAMES.get(p, str(p)): count for p, count in self.granted.items()},
+                "rejected": {PRIORITY_NAMES.get(p, str(p)): count for p, count in self.rejected.items()},
+            }
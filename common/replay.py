@@ -0,0 +1,125 @@
+# Record Bing Maps responses to disk and replay them, so the server can be load tested without network access.
+
+import os
+import json
+import hashlib
+import threading
+import requests
+from urllib.parse import urlsplit, unquote
+
+API_ROOT = "/rest/v1"
+
+# the departure time changes with every request, a recording is replayed for any departure time.
+IGNORED_PARAMS = ("key", "datetime", "starttime")
+
+
+def get_request_path(url):
+    """
+    :return: path of the url relative to the root of the Bing REST services, e.g. "/Routes/Transit"
+    """
+    path = unquote(urlsplit(url).path)
+    index = path.lower().find(API_ROOT)
+    return path[index + len(API_ROOT):] if index >= 0 else path
+
+
+def get_request_key(url, params):
+    """
+    :return: key identifying a request, the same for the url of Bing and of a stub server
+    """
+    params = sorted((str(name), str(value)) for name, value in (params or {}).items()
+                    if name.lower() not in IGNORED_PARAMS)
+    request = json.dumps([get_request_path(url).lower(), params])
+    return hashlib.sha1(request.encode("utf-8")).hexdigest()
+
+
+def get_recording_file(directory, url, params):
+    return os.path.join(directory, get_request_key(url, params) + ".json")
+
+
+def load_recording(directory, url, params):
+    """
+    :return: the recorded response body for the request, None if it was not recorded
+    :rtype: dict
+    """
+    try:
+        with open(get_recording_file(directory, url, params), 'r') as recording:
+            return json.load(recording)["response"]
+    except (IOError, OSError):
+        return None
+
+
+class RecordingTransport(object):
+    """
+        Transport that saves every successful response of the wrapped transport under `directory`.
+    """
+
+    def __init__(self, transport, directory):
+        self.transport = transport
+        self.directory = directory
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __getattr__(self, name):
+        # timeouts, retries etc. of the wrapped transport
+        return getattr(self.transport, name)
+
+    def get(self, endpoint, url, params=None):
+        response = self.transport.get(endpoint, url, params)
+        if response.status_code != 200:
+            return response
+
+        recording = {
+            "endpoint": endpoint,
+            "path": get_request_path(url),
+            "params": {name: value for name, value in (params or {}).items() if name != "key"},
+            "response": response.json()
+        }
+
+        filename = get_recording_file(self.directory, url, params)
+        with self._lock:
+            with open(filename + ".tmp", 'w') as recording_file:
+                json.dump(recording, recording_file, indent=2, sort_keys=True)
+            os.rename(filename + ".tmp", filename)
+
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class _ReplayedResponse(object):
+    status_code = 200
+
+    def __init__(self, response_dict):
+        self._response_dict = response_dict
+
+    def json(self):
+        return self._response_dict
+
+
+class ReplayTransport(object):
+    """
+        Transport that answers from the responses recorded by RecordingTransport, without any network access.
+    """
+
+    def __init__(self, directory, timeouts=None, max_retries=0):
+        self.directory = directory
+        self.timeouts = timeouts or {}
+        self.max_retries = max_retries
+
+    def get(self, endpoint, url, params=None):
+        response_dict = load_recording(self.directory, url, params)
+        if response_dict is None:
+            raise requests.ConnectionError("No recorded response for {} {}".format(get_request_path(url), params))
+        return _ReplayedResponse(response_dict)
+
+    def _backoff(self, attempt, retry_after=None):
+        return 0
+
+    def open_connections(self, url, count):
+        return 0
+
+    def close(self):
+        pass
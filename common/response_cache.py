@@ -0,0 +1,155 @@
+import time
+import datetime
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from common.cache import TTLCache
+from common.singleflight import SingleFlight
+
+DEFAULT_RESPONSE_CACHE_SIZE = 5000
+DEFAULT_RESPONSE_SOFT_TTL = 60  # seconds
+DEFAULT_RESPONSE_TIME_BUCKET = 15 * 60  # seconds
+DEFAULT_REFRESH_WORKERS = 2
+
+
+class ResponseCache(object):
+    """
+        Cache of whole responses with stale-while-revalidate.
+
+        A response younger than `soft_ttl` is served as is. An older one is still served right away, and a
+        single background refresh per key replaces it, so that a hot key only pays for a full computation
+        the first time it is requested. Concurrent misses of a key share a single computation. Entries are
+        dropped after `hard_ttl`, which defaults to the width of the departure time buckets the keys are
+        built with.
+    """
+
+    def __init__(self, max_size=DEFAULT_RESPONSE_CACHE_SIZE, soft_ttl=DEFAULT_RESPONSE_SOFT_TTL, hard_ttl=None,
+                 time_bucket=DEFAULT_RESPONSE_TIME_BUCKET, refresh_workers=DEFAULT_REFRESH_WORKERS, singleflight=None):
+        """
+        :param max_size: maximum number of cached responses
+        :param soft_ttl: seconds after which a served response is refreshed in the background
+        :param hard_ttl: seconds after which a response is not served anymore, defaults to `time_bucket`
+        :param time_bucket: width in seconds of the departure time buckets, see get_departure_bucket
+        :param refresh_workers: maximum number of concurrent background refreshes
+        :param singleflight: coalesces the concurrent computations of a key
+        :type singleflight: SingleFlight
+        """
+        self.soft_ttl = soft_ttl
+        self.time_bucket = time_bucket
+        self.refresh_workers = refresh_workers
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+        self._entries = TTLCache(max_size=max_size, ttl=hard_ttl or time_bucket)
+        self._refreshing = set()
+        self._singleflight = SingleFlight() if singleflight is None else singleflight
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get_departure_bucket(self, timestamp=None):
+        """
+        :param timestamp: departure time in seconds since the epoch, defaults to now
+        :return: departure time bucket to include in the keys
+        :rtype: int
+        """
+        return int((time.time() if timestamp is None else timestamp) // self.time_bucket)
+
+    def get_or_compute(self, key, compute, adapt=None, refresh=None):
+        """
+        :param key: hashable key of the response
+        :param compute: function without arguments that computes the response
+        :param adapt: function of (cached response, datetime it was computed at) that returns the response to
+                      serve now, or None if the cached response can no longer be served. It must not modify
+                      the cached response.
+        :param refresh: function without arguments that computes the response in the background, outside of
+                        the request, defaults to `compute`
+        :return: the cached, adapted response if there is one, otherwise the computed response. The computed
+                 response may be shared with concurrent callers and must not be modified.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            computed_at_monotonic, computed_at, response = entry
+            served = adapt(response, computed_at) if adapt else response
+
+            if served is not None:
+                is_stale = time.monotonic() - computed_at_monotonic > self.soft_ttl
+                with self._lock:
+                    self.hits += 1
+                    if is_stale:
+                        self.stale_hits += 1
+                if is_stale:
+                    self._refresh(key, refresh or compute)
+                return served
+
+        with self._lock:
+            self.misses += 1
+        return self._singleflight.do("recommendations_response", key,
+                                     functools.partial(self._compute_and_set, key, compute))
+
+    def _compute_and_set(self, key, compute):
+        computed_at_monotonic, computed_at = time.monotonic(), datetime.datetime.now()
+        response = compute()
+        self._entries.set(key, (computed_at_monotonic, computed_at, response))
+        return response
+
+    def _refresh(self, key, compute):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.refresh_workers,
+                                                    thread_name_prefix="response-refresh")
+
+        self._executor.submit(self._run_refresh, key, compute)
+
+    def _run_refresh(self, key, compute):
+        try:
+            self._compute_and_set(key, compute)
+        except Exception:
+            # the stale response keeps being served until its hard ttl
+            with self._lock:
+                self.refresh_errors += 1
+        else:
+            with self._lock:
+                self.refreshes += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._singleflight.clear()
+        with self._lock:
+            self.hits = 0
+            self.stale_hits = 0
+            self.misses = 0
+            self.refreshes = 0
+            self.refresh_errors = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        :return: dict of size, hits, stale hits, misses, misses that shared a computation in flight, background
+                 refreshes and hit ratio of the cache
+        """
+        coalesced = self._singleflight.stats()["saved"]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self._entries.max_size,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced_misses": coalesced,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "hit_ratio": float(self.hits) / lookups if lookups else 0.0
+            }
@@ -4,6 +4,7 @@
 
 class LyftEstimate(object):
 
+    name = "lyft"
     base_fare = 1.42
     cancel_fee = 5.00
     cost_per_mile = 1.48
@@ -14,32 +15,43 @@ class LyftEstimate(object):
     service_fee = 2.00
     seattle_city_fee = 0.24
 
+    @classmethod
+    def fees(cls):
+        return cls.base_fare + cls.service_fee + cls.seattle_city_fee
+
     @classmethod
     def estimate_fare(cls, distance, duration):
          total_cost_per_mile = distance * cls.cost_per_mile
          total_cost_per_minute = (duration/60.0) * cls.cost_per_minute
-         fees = cls.base_fare + cls.service_fee + cls.seattle_city_fee
+         fees = cls.fees()
          fare = total_cost_per_mile + total_cost_per_minute + fees
          fare = max(fare, cls.min_fare)
+         fare = min(fare, cls.max_fare)
          return fare
 
 
 class UberEstimate(object):
 
+    name = "uberx"
     base_fare = 1.42
     cancel_fee = 5.00
     cost_per_mile = 1.48
     cost_per_minute = 0.25
+    max_fare = None
     min_fare = 5.45
     booking_fee = 1.95
 
+    @classmethod
+    def fees(cls):
+        return cls.base_fare + cls.booking_fee
+
     @classmethod
     def estimate_fare(cls, distance, duration):
         # must calculate driver's distance from destination and include cost per minute/hour for pickup
         # must implement cancellations
         total_cost_per_mile = distance * cls.cost_per_mile
         total_cost_per_minute = (duration / 60.0) * cls.cost_per_minute
-        fees = cls.base_fare + cls.booking_fee
+        fees = cls.fees()
         fare = total_cost_per_mile + total_cost_per_minute + fees
         fare = max(fare, cls.min_fare)
         return fare
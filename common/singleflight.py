@@ -0,0 +1,146 @@
+import asyncio
+import threading
+from common import metrics
+
+COALESCED_CALLS = metrics.Counter("bing_coalesced_calls_total",
+                                  "Bing Maps API calls saved by sharing an identical call already in flight.",
+                                  ["endpoint"])
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+        Coalesces concurrent identical calls: while a call for a key is in flight, other callers asking for
+        the same key wait for it and share its result, or its exception, instead of making the call again.
+        Nothing is kept once the call returns, caching the result is up to the caller.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = {}  # endpoint -> number of callers that shared a call in flight
+
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, endpoint, key, function):
+        """
+        :param endpoint: Bing endpoint the call is made to, keys are only compared within an endpoint
+        :param key: hashable, normalized arguments of the call
+        :param function: function without arguments that makes the call
+        :return: the result of `function`, called by this caller or by a concurrent one
+        :raises: the exception raised by `function`
+        """
+        with self._lock:
+            call = self._in_flight.get((endpoint, key))
+            is_leader = call is None
+            if is_leader:
+                call = self._in_flight[(endpoint, key)] = _Call()
+            else:
+                self.shared[endpoint] = self.shared.get(endpoint, 0) + 1
+
+        if not is_leader:
+            COALESCED_CALLS.inc(endpoint=endpoint)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[(endpoint, key)]
+                self.calls += 1
+            call.done.set()
+        return call.result
+
+    def clear(self):
+        with self._lock:
+            self.calls = 0
+            self.shared = {}
+
+    def stats(self):
+        """
+        :return: dict of calls made, calls in flight and calls saved, in total and per endpoint
+        """
+        with self._lock:
+            saved = sum(self.shared.values())
+            return {
+                "calls": self.calls,
+                "in_flight": len(self._in_flight),
+                "saved": saved,
+                "saved_by_endpoint": dict(self.shared),
+                "saved_ratio": float(saved) / (self.calls + saved) if self.calls + saved else 0.0
+            }
+
+
+class AsyncSingleFlight(object):
+    """
+        asyncio version of SingleFlight: while a call for a key is in flight, other tasks of the event loop
+        asking for the same key await it instead of making the call again.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = {}  # endpoint -> number of callers that shared a call in flight
+
+        self._in_flight = {}
+
+    async def do(self, endpoint, key, function):
+        """
+        :param endpoint: Bing endpoint the call is made to, keys are only compared within an endpoint
+        :param key: hashable, normalized arguments of the call
+        :param function: coroutine function without arguments that makes the call
+        :return: the result of `function`, awaited by this caller or by a concurrent one
+        :raises: the exception raised by `function`
+        """
+        call = self._in_flight.get((endpoint, key))
+        if call is not None:
+            self.shared[endpoint] = self.shared.get(endpoint, 0) + 1
+            COALESCED_CALLS.inc(endpoint=endpoint)
+            # a cancelled caller must not cancel the call of the others
+            return await asyncio.shield(call)
+
+        call = self._in_flight[(endpoint, key)] = asyncio.get_running_loop().create_future()
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as e:
+            call.set_exception(e)
+            call.exception()  # retrieved, even if no other caller awaits it
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            del self._in_flight[(endpoint, key)]
+            self.calls += 1
+
+    def clear(self):
+        self.calls = 0
+        self.shared = {}
+
+    def stats(self):
+        """
+        :return: dict of calls made, calls in flight and calls saved, in total and per endpoint
+        """
+        saved = sum(self.shared.values())
+        return {
+            "calls": self.calls,
+            "in_flight": len(self._in_flight),
+            "saved": saved,
+            "saved_by_endpoint": dict(self.shared),
+            "saved_ratio": float(saved) / (self.calls + saved) if self.calls + saved else 0.0
+        }
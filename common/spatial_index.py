@@ -0,0 +1,196 @@
+import csv
+import math
+import time
+import threading
+from collections import OrderedDict
+
+METERS_PER_DEGREE = 111320.0
+DEFAULT_CELL_SIZE = 50  # meters
+DEFAULT_MAX_POINTS = 2000000
+DEFAULT_MAX_INSERTED = 50000  # same bound as the reverse geocode cache the inserted points come from
+DEFAULT_INSERTED_TTL = 24 * 60 * 60  # seconds
+
+
+def _distance(lat1, long1, lat2, long2):
+    """
+    :return: approximate distance in meters between two points, accurate to well under 1% at city scale
+    """
+    x = math.radians(long2 - long1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return math.sqrt(x * x + y * y) * 6371000.0
+
+
+class SpatialIndex(object):
+    """
+        Grid index of known addresses, used to answer reverse geocodes without calling Bing.
+
+        Points are bucketed in square cells of `cell_size` meters of latitude, a nearest neighbour query only
+        scans the cells that intersect its search radius.
+
+        Bulk loaded points, e.g. the stops of a transit agency, are kept until the index is cleared. Points added
+        one by one, e.g. the results of reverse geocodes, expire after `inserted_ttl` seconds and only the
+        `max_inserted` most recent of them are kept, like the entries of a TTLCache.
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE, max_points=DEFAULT_MAX_POINTS, max_inserted=DEFAULT_MAX_INSERTED,
+                 inserted_ttl=DEFAULT_INSERTED_TTL):
+        """
+        :param cell_size: height of the grid cells in meters
+        :param max_points: points are ignored once the index holds that many points
+        :param max_inserted: number of inserted points kept, the oldest one is dropped to make room for a new one
+        :param inserted_ttl: seconds an inserted point is served for
+        """
+        if max_inserted <= 0:
+            raise ValueError("max_inserted must be a positive integer.")
+
+        self.cell_size = cell_size
+        self.max_points = max_points
+        self.max_inserted = max_inserted
+        self.inserted_ttl = inserted_ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._cell_degrees = cell_size / METERS_PER_DEGREE
+        self._cells = {}  # cell -> list of (latitude, longitude, location, expires_at)
+        self._inserted = OrderedDict()  # (latitude, longitude) -> (cell, point) of the inserted points, oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _cell(self, latitude, longitude):
+        return int(math.floor(latitude / self._cell_degrees)), int(math.floor(longitude / self._cell_degrees))
+
+    def _remove(self, cell, point):
+        # lists are replaced rather than changed in place, so that a concurrent nearest can keep iterating
+        cell_points = [cell_point for cell_point in self._cells[cell] if cell_point is not point]
+        if cell_points:
+            self._cells[cell] = cell_points
+        else:
+            del self._cells[cell]
+        self._size -= 1
+
+    def _evict_inserted(self, now):
+        while self._inserted:
+            cell, point = next(iter(self._inserted.values()))
+            if point[3] > now and len(self._inserted) < self.max_inserted:
+                break
+            self._inserted.popitem(last=False)
+            self._remove(cell, point)
+
+    def insert(self, latitude, longitude, location):
+        """
+        :param latitude: latitude the location is the address of
+        :param longitude: longitude the location is the address of
+        :type location: BingLocation
+        :return: True if the point was added
+        """
+        latitude, longitude = float(latitude), float(longitude)
+        cell = self._cell(latitude, longitude)
+        now = time.monotonic()
+        point = (latitude, longitude, location, now + self.inserted_ttl)
+
+        with self._lock:
+            previous = self._inserted.pop((latitude, longitude), None)
+            if previous is not None:
+                self._remove(*previous)
+            self._evict_inserted(now)
+            if self._size >= self.max_points:
+                return False
+            self._cells[cell] = self._cells.get(cell, []) + [point]
+            self._inserted[(latitude, longitude)] = (cell, point)
+            self._size += 1
+            return True
+
+    def bulk_load(self, points):
+        """
+        :param points: iterable of (latitude, longitude, BingLocation)
+        :return: number of points added
+        """
+        cells = {}
+        for latitude, longitude, location in points:
+            latitude, longitude = float(latitude), float(longitude)
+            cells.setdefault(self._cell(latitude, longitude), []).append((latitude, longitude, location,
+                                                                          float("inf")))
+
+        with self._lock:
+            added = 0
+            for cell, cell_points in cells.items():
+                cell_points = cell_points[:max(self.max_points - self._size, 0)]
+                if cell_points:
+                    self._cells[cell] = self._cells.get(cell, []) + cell_points
+                    self._size += len(cell_points)
+                    added += len(cell_points)
+            return added
+
+    def bulk_load_locations(self, locations):
+        """
+        :param locations: locations indexed at their own point
+        :type locations: iterable of BingLocation
+        """
+        return self.bulk_load((location.point_list[0], location.point_list[1], location) for location in locations)
+
+    def bulk_load_file(self, filename):
+        """
+        :param filename: csv file with `lat`, `long` and `address` columns, e.g. the stops of a transit agency
+        :return: number of points added
+        """
+        from common.bing_maps import BingLocation
+
+        with open(filename, newline='') as csv_file:
+            return self.bulk_load((row["lat"], row["long"], BingLocation([float(row["lat"]), float(row["long"])],
+                                                                          row["address"]))
+                                  for row in csv.DictReader(csv_file))
+
+    def nearest(self, latitude, longitude, radius):
+        """
+        :param radius: maximum distance in meters
+        :return: closest location within radius of the point or None
+        :rtype: BingLocation
+        """
+        latitude, longitude = float(latitude), float(longitude)
+        center_row, center_column = self._cell(latitude, longitude)
+
+        rows = int(math.ceil(radius / self.cell_size))
+        longitude_scale = max(math.cos(math.radians(latitude)), 1e-6)
+        columns = int(math.ceil(radius / (self.cell_size * longitude_scale)))
+
+        now = time.monotonic()
+        best, best_distance = None, radius
+        for row in range(center_row - rows, center_row + rows + 1):
+            for column in range(center_column - columns, center_column + columns + 1):
+                for point_latitude, point_longitude, location, expires_at in self._cells.get((row, column), ()):
+                    if expires_at <= now:
+                        continue
+                    distance = _distance(latitude, longitude, point_latitude, point_longitude)
+                    if distance <= best_distance:
+                        best, best_distance = location, distance
+
+        with self._lock:
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def clear(self):
+        with self._lock:
+            self._cells = {}
+            self._inserted = OrderedDict()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "max_size": self.max_points,
+                "inserted": len(self._inserted),
+                "max_inserted": self.max_inserted,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": float(self.hits) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,123 @@
+import time
+import random
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_BASE = 0.1  # seconds
+DEFAULT_BACKOFF_CAP = 2.0  # seconds
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# (connect, read) timeouts in seconds, per endpoint
+DEFAULT_TIMEOUT = (3.05, 10)
+DEFAULT_TIMEOUTS = {
+    "locations_query": (3.05, 5),
+    "locations_point": (3.05, 5),
+    "transit": (3.05, 15),
+    "driving": (3.05, 10),
+    "distance_matrix": (3.05, 15),
+}
+
+
+class BingTransport(object):
+    """
+        Connection pooled, keep-alive HTTP transport used for every Bing Maps call.
+
+        A single instance is safe to share between threads: connections are taken from and
+        returned to the pool of the underlying requests session. Idempotent GETs that fail with
+        a connection error, a timeout or a retryable status are retried with jittered
+        exponential backoff.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeouts=None, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_cap=DEFAULT_BACKOFF_CAP):
+        """
+        :param pool_size: maximum number of kept alive connections per host
+        :type pool_size: int
+        :param timeouts: (connect, read) timeouts keyed by endpoint name, merged into DEFAULT_TIMEOUTS
+        :type timeouts: dict
+        :param max_retries: number of retries after the first attempt
+        :type max_retries: int
+        :param backoff_base: backoff before the first retry, doubled for every following retry
+        :param backoff_cap: upper bound of the backoff in seconds
+        """
+        self.pool_size = pool_size
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, endpoint, url, params=None):
+        """
+        :param endpoint: name of the endpoint, used to pick the timeouts
+        :type endpoint: str
+        :param url: url to GET
+        :param params: query string parameters
+        :return: the response of the last attempt
+        :rtype: requests.Response
+        :raises: requests.RequestException if the last attempt failed to connect or timed out
+        """
+        timeout = self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.get(url, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        # "full jitter" backoff, so that clients throttled together do not retry together.
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_cap)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def open_connections(self, url, count):
+        """
+        Open up to `count` kept alive connections to the host of `url`, e.g. when a worker starts, so that its
+        first requests do not pay for the TCP and TLS handshakes.
+
+        :return: number of connections that could be opened
+        :rtype: int
+        """
+        count = min(count, self.pool_size)
+        if count <= 0:
+            return 0
+
+        def _open(_):
+            # any response opens the connection, the concurrent requests make the pool keep `count` of them
+            try:
+                self.session.head(url, timeout=DEFAULT_TIMEOUT).close()
+                return True
+            except requests.RequestException:
+                return False
+
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            return sum(executor.map(_open, range(count)))
+
+    def close(self):
+        """
+        Close the pooled connections, the transport opens new ones when it is used again.
+        """
+        self.session.close()
@@ -17,7 +17,7 @@ def is_correct_type_or_err(obj, cls):
 
 def handle_error(ex=None, status_code=400, message=None):
     data = {
-        "message": message or ex.message if hasattr(ex, 'message') else str(ex)
+        "message": message or (ex.message if hasattr(ex, 'message') else str(ex))
     }
     abort(status_code, **data)
 
@@ -0,0 +1,54 @@
+import time
+import threading
+
+DEFAULT_WARMUP_CONNECTIONS = 8
+
+
+class Warmup(object):
+    """
+        Startup work that makes a server process ready to take full load, and the readiness it reports.
+
+        The in memory caches are filled from the persistent cache when the shared BingMaps client is created,
+        which happens once before the workers are forked when the app is preloaded. `run` does the rest in
+        every worker: it drops any connection inherited from the parent process and opens the connections
+        of the pool, so that the first requests of the worker are as fast as the following ones.
+    """
+
+    def __init__(self, bing_maps, connections=DEFAULT_WARMUP_CONNECTIONS):
+        """
+        :type bing_maps: BingMaps
+        :param connections: kept alive connections to open to Bing
+        """
+        self.bing_maps = bing_maps
+        self.connections = connections
+
+        self.ready = False
+        self.duration = None
+        self.opened_connections = 0
+        self._lock = threading.Lock()
+
+    def run(self, after_fork=False):
+        """
+        :param after_fork: the process was forked from the one that created the client, whose connections
+                           must not be shared
+        """
+        with self._lock:
+            start = time.perf_counter()
+            if after_fork:
+                self.bing_maps.transport.close()
+
+            self.opened_connections = self.bing_maps.transport.open_connections(self.bing_maps.base_url,
+                                                                                self.connections)
+            self.duration = time.perf_counter() - start
+            self.ready = True
+
+    def stats(self):
+        """
+        :return: dict of readiness, warmup duration, opened connections and in memory cache sizes
+        """
+        return {
+            "ready": self.ready,
+            "warmup_seconds": self.duration,
+            "opened_connections": self.opened_connections,
+            "cache_sizes": {name: stats["size"] for name, stats in self.bing_maps.cache_stats().items()},
+        }
@@ -1,8 +1,14 @@
 
+import json
 import requests
 import datetime
+from argparse import ArgumentParser
 
 url = "http://127.0.0.1:5000/recommendations"
+stream_url = "http://127.0.0.1:5000/recommendations/stream"
+
+# routes of each type that are printed, the server only builds that many
+MAX_ROUTES = 3
 
 def get_input():
     source = input("Enter the source address (default to alki beach): ").strip() or "alki beach"
@@ -15,13 +21,30 @@ def get_recommendations(source, dest):
     params = {
         "start": source,
         "dest": dest,
-        "optimise_for": "time"
+        "optimise_for": "time",
+        "max_routes": MAX_ROUTES
     }
 
     resp = requests.post(url=url, json=params)
 
     return resp.json()
 
+def get_recommendations_stream(source, dest):
+    """
+    :return: generator of the routes as the server computes them, then of the summary
+    """
+    params = {
+        "start": source,
+        "dest": dest,
+        "optimise_for": "time",
+        "max_routes": MAX_ROUTES
+    }
+
+    with requests.post(url=stream_url, json=params, stream=True) as resp:
+        for line in resp.iter_lines():
+            if line:
+                yield json.loads(line)
+
 def get_duration_from_secs(duration):
     return datetime.timedelta(seconds=duration)
 
@@ -55,10 +78,35 @@ def print_segments(seg):
     print(seg_str)
 
 
+def print_recommendations_stream(source, dest):
+    # rideshare and transit routes are always recommended, print them as they arrive.
+    # hybrid routes are filtered and ranked by the summary.
+    hybrid_recs = {}
+    print("\n")
+    for rec in get_recommendations_stream(source, dest):
+        if rec["type"] == "error":
+            print("Error: " + rec["message"])
+        elif rec["type"] == "summary":
+            ranked_hybrids = [hybrid_recs[rec_id] for rec_id in rec["ids"] if rec_id in hybrid_recs]
+            for hybrid_rec in ranked_hybrids[:MAX_ROUTES]:
+                print_recommendation_item(hybrid_rec)
+        elif rec["type"] == "complex":
+            hybrid_recs[rec["id"]] = rec
+        else:
+            print_recommendation_item(rec)
+
+
 def main():
+    parser = ArgumentParser(description="Print the recommendations of the server running locally")
+    parser.add_argument('--stream', action='store_true', help="print the routes as soon as the server computes them")
+    args = parser.parse_args()
 
     while True:
         source, dest = get_input()
+        if args.stream:
+            print_recommendations_stream(source, dest)
+            continue
+
         recommendations = get_recommendations(source, dest)
 
         num_transit = 0
@@ -67,11 +115,11 @@ def main():
         new_recs = []
         for rec in recommendations:
             if rec["type"] == "transit":
-                if num_transit < 3:
+                if num_transit < MAX_ROUTES:
                     new_recs.append(rec)
                     num_transit += 1
             elif rec["type"] == "complex":
-                if num_hybrid < 3:
+                if num_hybrid < MAX_ROUTES:
                     new_recs.append(rec)
                     num_hybrid += 1
             else:
@@ -0,0 +1,36 @@
+# Production serving: gunicorn --config gunicorn.conf.py app:app from the root of the repo,
+# or python app.py --production. Every setting can be overridden with the environment variables below.
+
+import os
+import multiprocessing
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+
+# requests mostly wait on Bing, so every worker process serves several of them with threads
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+# every worker has its own Bing rate limiter, BING_MAPS_RATE_LIMIT and BING_MAPS_RATE_BURST are split between
+# them so that they hold for the whole server. Set before the app is loaded, see common/bing_maps.py.
+os.environ.setdefault("BING_MAPS_RATE_LIMIT_WORKERS", str(workers))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# the app, its Bing client and the caches loaded from disk are created once in the master, then shared
+# copy on write by the forked workers
+preload_app = True
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # runs in the worker before it accepts any request, so that it joins the pool ready for full load
+    import app
+
+    app.warmup.run(after_fork=True)
+    server.log.info("Worker %s warmed up in %.3fs, %d connections opened", worker.pid, app.warmup.duration,
+                    app.warmup.opened_connections)
@@ -1,18 +1,44 @@
-import sys
-from flask import request
+import json
+import asyncio
+import datetime
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, Response
 from flask_restful import Resource
+from common import metrics
+from common import ranking
+from common.autocomplete import normalize_query
 from common.util import handle_error, assert_equals_or_warn
 from common.optimizer  import RouteOptimizer
-from common.bing_maps import BingLocation, BingMaps, BingApiError, BingDateTime, BingTransportSegment, BingTransitRoute
+from common.async_optimizer import AsyncRouteOptimizer
+from common.bing_maps import (BingApiError, BingDateTime, BingTransportSegment, BingTransitRoute,
+                              get_default_bing_maps, _quantize_point)
 
+# Bing calls a recommendation request makes before it stops looking for hybrid routes. A cold request for
+# 4 transit routes takes about 20 calls, or about 30 when the distance matrix fails.
+DEFAULT_CALL_BUDGET = 50
 
-class PlaceAutocomplete(Resource):
+
+class BingResource(Resource):
+    """
+        Base resource for endpoints that use the Bing Maps API. The client is injected through
+        `resource_class_kwargs` so that every request shares its caches and connection pool.
+    """
+    def __init__(self, bing_maps=None):
+        super(BingResource, self).__init__()
+        self.bing_maps = bing_maps or get_default_bing_maps()
+
+
+class PlaceAutocomplete(BingResource):
     def get(self, query):
+        with metrics.track_request("place_autocomplete"):
+            return self._get(query)
+
+    def _get(self, query):
         address_list = []
-        bing_map = BingMaps()
 
         try:
-            address_list = bing_map.get_possible_locations_from_string(query)
+            address_list = self.bing_maps.get_possible_locations_from_string(query)
         except BingApiError as e:
             handle_error(ex=e)
 
@@ -27,18 +53,20 @@ class PlaceAutocomplete(Resource):
         return duration_list, 200
 
 
-class PointToAddress(Resource):
+class PointToAddress(BingResource):
     def get(self, query):
+        with metrics.track_request("point_to_address"):
+            return self._get(query)
+
+    def _get(self, query):
         try:
             lat, long = query.split(",")
         except ValueError:
             msg = "Wrong lat,long format. Please supply latitude and longitude in the following format: 'lat,long'"
             handle_error(message=msg)
 
-        bing_maps = BingMaps()
-
         try:
-            location = bing_maps.get_location_from_point(
+            location = self.bing_maps.get_location_from_point(
                 lat.strip(), long.strip())
         except BingApiError as e:
             handle_error(ex=e)
@@ -51,226 +79,502 @@ class PointToAddress(Resource):
         return duration, 200
 
 
-class Recommendations(Resource):
+class Recommendations(BingResource):
 
-    def post(self):
-        self.bing_maps = BingMaps()
+    def __init__(self, bing_maps=None, response_cache=None, call_budget=DEFAULT_CALL_BUDGET):
+        """
+        :param response_cache: cache of whole responses, responses are always computed if not supplied
+        :type response_cache: ResponseCache
+        :param call_budget: Bing calls a request makes before it stops looking for hybrid routes, None for no limit
+        :type call_budget: int
+        """
+        super(Recommendations, self).__init__(bing_maps)
+        self.response_cache = response_cache
+        self.call_budget = call_budget
 
+    def post(self):
+        with metrics.track_request("recommendations", call_budget=self.call_budget):
+            return self._post()
 
+    def _post(self):
         _request_body = request.json
         start = _request_body["start"]
         dest = _request_body["dest"]
-        optimisation_type = _request_body["optimise_for"].lower()
+        optimisation_type = _get_optimisation_type(_request_body)
+        max_routes = _get_max_routes(_request_body)
+
+        if self.response_cache is None:
+            return self._get_recommendations(start, dest, optimisation_type, max_routes)
+
+        compute = functools.partial(self._get_recommendations, start, dest, optimisation_type, max_routes)
+        refresh = functools.partial(self._refresh_recommendations, start, dest, optimisation_type, max_routes)
+        cache_key = self._get_response_cache_key(start, dest, optimisation_type, max_routes)
+        return self.response_cache.get_or_compute(cache_key, compute, adapt=_shift_response_list, refresh=refresh)
+
+    def _refresh_recommendations(self, start, dest, optimisation_type, max_routes=None):
+        # background refreshes have the budget and the metrics of a request of their own
+        with metrics.track_request("recommendations_refresh", call_budget=self.call_budget):
+            return self._get_recommendations(start, dest, optimisation_type, max_routes)
+
+    def _get_response_cache_key(self, start, dest, optimisation_type, max_routes=None):
+        start_point, dest_point = _get_lat_long_points(start, dest)
+
+        try:
+            if start_point:
+                start = _quantize_point(start_point[0], start_point[1], self.bing_maps.point_precision)
+                dest = _quantize_point(dest_point[0], dest_point[1], self.bing_maps.point_precision)
+        except BingApiError:
+            pass  # not points after all, computing the response reports the error
+
+        if not isinstance(start, tuple):
+            start, dest = normalize_query(start), normalize_query(dest)
+
+        return start, dest, optimisation_type, max_routes, self.response_cache.get_departure_bucket()
+
+    def _get_recommendations(self, start, dest, optimisation_type, max_routes=None):
+        """
+        :param max_routes: number of transit routes and of hybrid routes to return, all of them if None. Only
+                           the returned transit routes are built and have their addresses looked up.
+        """
+        with metrics.time_stage("geocode"):
+            start_location, dest_location = self._get_locations(start, dest)
+
+        depart_time = BingDateTime.now()
+
+        with metrics.time_stage("routes"):
+            optimizer = RouteOptimizer(start_location, dest_location, optimisation_type, depart_time,
+                                       bing_maps=self.bing_maps, max_transit_routes=max_routes)
+
+        # rideshare legs of the hybrid routes of all transit routes are fetched concurrently
+        with metrics.time_stage("hybrids"):
+            all_complex_routes = optimizer.get_simple_hybrids(optimizer.basic_transit_routes)
 
-        start_point = start.split(",")
-        dest_point = dest.split(",")
+        with metrics.time_stage("response"):
+            return _get_response_list(optimizer, all_complex_routes, max_routes)
 
-        is_lat_long = True
-        if len(start_point) != len(dest_point) or len(start_point) != 2:
-            start_point = None
-            dest_point = None
-            is_lat_long = False
+    def _get_locations(self, start, dest):
+        start_point, dest_point = _get_lat_long_points(start, dest)
 
-        if is_lat_long:
+        if start_point:
             start_location = self.bing_maps.get_location_from_point(start_point[0], start_point[1])
             dest_location = self.bing_maps.get_location_from_point(dest_point[0], dest_point[1])
         else:
             start_location = self.bing_maps.get_location_from_string(start)
             dest_location = self.bing_maps.get_location_from_string(dest)
 
+        return start_location, dest_location
 
-        depart_time = BingDateTime.now()
 
-        optimizer = RouteOptimizer(start_location, dest_location, optimisation_type, depart_time)
+class RecommendationsStream(Recommendations):
+    """
+        Same routes as Recommendations as newline delimited JSON, each route as soon as it is ready: the
+        rideshare routes, the transit routes, then every hybrid route. Every route has an `id`, the last line
+        is a summary with the ids of the routes in the order Recommendations returns them, e.g.
+        {"type": "summary", "ids": [2, 3, 0, 1, 7]}. A failure is reported as {"type": "error", "message": ...}.
+    """
 
-        response_list = []
-        optimized_list = []
+    def post(self):
+        _request_body = request.json
+        start = _request_body["start"]
+        dest = _request_body["dest"]
+        optimisation_type = _get_optimisation_type(_request_body)
+        max_routes = _get_max_routes(_request_body)
 
-        uber_route = optimizer.uber_route
-        lyft_route = optimizer.lyft_route
-        transit_routes = optimizer.basic_transit_routes
+        return Response(self._stream(start, dest, optimisation_type, max_routes), mimetype="application/x-ndjson")
 
-        uber_route_dict = self._process_ride_share_route(uber_route)
-        lyft_route_dict = self._process_ride_share_route(lyft_route)
+    def _stream(self, start, dest, optimisation_type, max_routes=None):
+        with metrics.track_request("recommendations_stream", call_budget=self.call_budget):
+            try:
+                for item in self._iter_routes(start, dest, optimisation_type, max_routes):
+                    yield json.dumps(item) + "\n"
+            except BingApiError as e:
+                yield json.dumps({"type": "error", "message": str(e)}) + "\n"
 
-        # largest cost should be the cheapest rideshare
-        max_cost = min(uber_route_dict["cost"], lyft_route_dict["cost"])
-        max_optimized_duration = None
+    def _iter_routes(self, start, dest, optimisation_type, max_routes=None):
+        ids = {}
 
-        for t_route in transit_routes:
-            transit_dict = self._process_transit_route(t_route)
-            response_list.append(transit_dict)
+        def _with_id(route_dict):
+            ids[id(route_dict)] = len(ids)
+            return dict(route_dict, id=ids[id(route_dict)])
 
-            # longest duration should be that of a regular transit route
-            max_optimized_duration = transit_dict["duration"] if max_optimized_duration is None else min(transit_dict["duration"], max_optimized_duration)
+        start_location, dest_location = self._get_locations(start, dest)
+        optimizer = RouteOptimizer(start_location, dest_location, optimisation_type, BingDateTime.now(),
+                                   bing_maps=self.bing_maps, init_routes=False, max_transit_routes=max_routes)
 
-            complex_routes = optimizer.get_simple_hybrid(t_route)
-            for cmp_route in complex_routes:
-                optimized_list.append(self._process_complex_route(cmp_route))
+        # the rideshare routes need a single driving route, the transit routes are fetched meanwhile
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            transit_future = executor.submit(metrics.in_current_context(optimizer.init_transit_routes))
 
-        response_list.append(uber_route_dict)
-        response_list.append(lyft_route_dict)
+            optimizer.init_ride_share_routes()
+            uber_route_dict = _process_ride_share_route(optimizer.uber_route)
+            lyft_route_dict = _process_ride_share_route(optimizer.lyft_route)
+            yield _with_id(uber_route_dict)
+            yield _with_id(lyft_route_dict)
 
-        max_optimized_duration = max(uber_route_dict["duration"], lyft_route_dict["duration"], max_optimized_duration)
+            transit_future.result()
 
+        transit_dicts = []
+        for t_route in optimizer.basic_transit_routes:
+            transit_dicts.append(_process_transit_route(t_route))
+            yield _with_id(transit_dicts[-1])
 
-        # filter suggested routes that are too slow or costly, sort by duration
-        optimized_list = list(filter(lambda route: route["cost"] < max_cost and route["duration"] < max_optimized_duration, optimized_list))
-        optimized_list = list(filter(_filter_routes_with_only_walk_rideshare, optimized_list))
-        optimized_list = sorted(optimized_list, key=lambda route: route["duration"])
-        response_list.extend(optimized_list)
+        complex_dicts = [[] for _ in transit_dicts]
+        for index, cmp_route in optimizer.iter_simple_hybrids(optimizer.basic_transit_routes):
+            complex_dicts[index].append(_process_complex_route(cmp_route))
+            yield _with_id(complex_dicts[index][-1])
 
+        ranked = _rank_routes(transit_dicts, uber_route_dict, lyft_route_dict,
+                              [complex_dict for dicts in complex_dicts for complex_dict in dicts], max_routes,
+                              optimizer.optimization_type)
+        yield {"type": "summary", "ids": [ids[id(route_dict)] for route_dict in ranked]}
 
-        return response_list
 
+class Liveness(Resource):
+    """
+        The process is up and serving requests.
+    """
 
+    def get(self):
+        return {"status": "alive"}, 200
 
 
+class Readiness(Resource):
+    """
+        The process has warmed up and can take its share of the load, 503 until then.
+    """
+
+    def __init__(self, warmup):
         """
-        Dummy dictionary of the object [Route, Route....] 
-        with one Route option.
+        :type warmup: Warmup
         """
-        routes_list = []
-        route_dict = dict()
-        segment_list = []
-        segment_dict = dict()
-        segment_dict["start"] = start
-        segment_dict["dest"] = dest
-        segment_dict["mode"] = "transit"
-        segment_dict["duration"] = 600
-        segment_dict["start_time"] = "07/23/2019 16:30"
-        segment_dict["end_time"] = "07/23/2019 16:40"
-        segment_dict["cost"] = 6.5
-        segment_dict["description"] = "Take bus 545"
-        segment_list.append(segment_dict)
-        route_dict["segments"] = segment_dict
-        route_dict["start"] = start
-        route_dict["dest"] = dest
-        route_dict["start_time"] = "07/23/2019 16:30"
-        route_dict["end_time"] = "07/23/2019 16:40"
-        route_dict["duration"] = 600
-        route_dict["cost"] = 6.5
-        routes_list.append(route_dict)
-
-        return routes_list, 201
-
-    def _process_ride_share_route(self, bing_ride_share):
-        segment_dict = {}
-        segment_dict["mode"] = "rideshare"
-        segment_dict["duration"] = bing_ride_share.duration.total_seconds()
-
-        segment_dict["start"] = bing_ride_share.source.address_dict()
-        segment_dict["dest"] = bing_ride_share.dest.address_dict()
-
-        segment_dict["start_time"] = bing_ride_share.time_requested.date_time_str
-        end_time = bing_ride_share.time_requested.date_time + bing_ride_share.duration
-        segment_dict["end_time"] = BingDateTime(end_time).date_time_str
-
-        segment_dict["cost"] = bing_ride_share.fare
-        segment_dict["description"] = "Use {} (factor in pickup/drop time).".format(bing_ride_share.type)
-
-        result = {
-            "segments": [segment_dict],
-            "cost": segment_dict["cost"],
-            "start": segment_dict["start"],
-            "dest": segment_dict["dest"],
-            "start_time": segment_dict["start_time"],
-            "end_time": segment_dict["end_time"],
-            "duration": segment_dict["duration"],
-            "type": "only_ride_share"
-        }
-
-        return result
-
-    def _process_transit_segment(self, bing_transit_segment):
-        segment_dict = {}
-        segment_dict["mode"] = "transit" if isinstance(bing_transit_segment, BingTransportSegment) else "walk"
-        segment_dict["duration"] = bing_transit_segment.duration.total_seconds()
-
-
-        if isinstance(bing_transit_segment, BingTransportSegment):
-            segment_dict["start"] = bing_transit_segment.depart_details.coords.address_dict()
-            segment_dict["dest"] = bing_transit_segment.arrive_details.coords.address_dict()
-        else:
-            segment_dict["start"] = bing_transit_segment.start_location.address_dict()
-            segment_dict["dest"] = None
+        super(Readiness, self).__init__()
+        self.warmup = warmup
+
+    def get(self):
+        stats = self.warmup.stats()
+        return dict(stats, status="ready" if stats["ready"] else "warming up"), 200 if stats["ready"] else 503
 
-        if isinstance(bing_transit_segment, BingTransportSegment):
-            segment_dict["start_time"] = bing_transit_segment.depart_details.time.date_time_str
-            segment_dict["end_time"] = bing_transit_segment.arrive_details.time.date_time_str
+
+class Metrics(BingResource):
+
+    def __init__(self, bing_maps=None, response_cache=None):
+        super(Metrics, self).__init__(bing_maps)
+        self.response_cache = response_cache
+
+    def get(self):
+        cache_stats = self.bing_maps.cache_stats()
+        if self.response_cache is not None:
+            cache_stats["recommendations_response"] = self.response_cache.stats()
+        return Response(metrics.render(cache_stats), mimetype="text/plain; version=0.0.4")
+
+
+async def get_recommendations_async(async_bing_maps, start, dest, optimisation_type, max_routes=None,
+                                    call_budget=DEFAULT_CALL_BUDGET):
+    """
+    asyncio version of Recommendations.post: start and dest are geocoded concurrently, then the rideshare
+    and transit routes, then every hybrid route.
+
+    :type async_bing_maps: AsyncBingMaps
+    :return: the same list of route dicts as Recommendations.post
+    """
+    with metrics.track_request("recommendations_async", call_budget=call_budget):
+        return await _get_recommendations_async(async_bing_maps, start, dest, optimisation_type, max_routes)
+
+
+async def _get_recommendations_async(async_bing_maps, start, dest, optimisation_type, max_routes=None):
+    start_point, dest_point = _get_lat_long_points(start, dest)
+
+    if start_point:
+        start_location, dest_location = await asyncio.gather(
+            async_bing_maps.get_location_from_point(start_point[0], start_point[1]),
+            async_bing_maps.get_location_from_point(dest_point[0], dest_point[1]))
+    else:
+        start_location, dest_location = await asyncio.gather(async_bing_maps.get_location_from_string(start),
+                                                             async_bing_maps.get_location_from_string(dest))
+
+    optimizer = await AsyncRouteOptimizer.create(start_location, dest_location, optimisation_type.lower(),
+                                                 BingDateTime.now(), async_bing_maps, max_transit_routes=max_routes)
+    all_complex_routes = await optimizer.get_simple_hybrids(optimizer.basic_transit_routes)
+
+    return _get_response_list(optimizer, all_complex_routes, max_routes)
+
+
+def _get_optimisation_type(request_body):
+    """
+    :return: the "optimise_for" objective of a request body, one of ranking.OBJECTIVES
+    """
+    try:
+        return ranking.normalize_objective(request_body["optimise_for"])
+    except (KeyError, ValueError):
+        handle_error(message="optimise_for must be one of {}".format(
+            ", ".join(ranking.OBJECTIVES + tuple(ranking.OBJECTIVE_ALIASES))))
+
+
+def _get_max_routes(request_body):
+    """
+    :return: the optional positive "max_routes" of a request body, None if it is not supplied
+    """
+    max_routes = request_body.get("max_routes")
+    if max_routes is None:
+        return None
+
+    if isinstance(max_routes, bool) or not isinstance(max_routes, int) or max_routes < 1:
+        handle_error(message="max_routes must be a positive integer")
+    return max_routes
+
+
+def _get_lat_long_points(start, dest):
+    """
+    :return: start and dest split into [lat, long] if both are points, (None, None) otherwise
+    """
+    start_point = start.split(",")
+    dest_point = dest.split(",")
+
+    if len(start_point) != len(dest_point) or len(start_point) != 2:
+        return None, None
+    return start_point, dest_point
+
+
+def _get_response_list(optimizer, all_complex_routes, max_routes=None):
+    """
+    Response of Recommendations.post and get_recommendations_async. Same routes as _rank_routes, but the hybrid
+    routes are ranked before they are converted to dicts, so that the ones that are dominated or beyond
+    `max_routes` are never converted.
+    """
+    uber_route_dict = _process_ride_share_route(optimizer.uber_route)
+    lyft_route_dict = _process_ride_share_route(optimizer.lyft_route)
+
+    transit_dicts = [_process_transit_route(t_route) for t_route in optimizer.basic_transit_routes]
+
+    complex_routes = [cmp_route for cmp_routes in all_complex_routes for cmp_route in cmp_routes]
+    candidates = [(cmp_route.total_duration.total_seconds(), cmp_route.total_fare, index)
+                  for index, cmp_route in enumerate(complex_routes) if _has_transit_ride(cmp_route)]
+    ranked = ranking.rank_routes(candidates, _get_route_records(transit_dicts, uber_route_dict, lyft_route_dict),
+                                 optimizer.optimization_type, max_routes)
+
+    response_list = transit_dicts
+    response_list.append(uber_route_dict)
+    response_list.append(lyft_route_dict)
+    response_list.extend(_process_complex_route(complex_routes[index]) for index in ranked)
+    return response_list
+
+def _process_ride_share_route(bing_ride_share):
+    segment_dict = {}
+    segment_dict["mode"] = "rideshare"
+    segment_dict["duration"] = bing_ride_share.duration.total_seconds()
+
+    segment_dict["start"] = bing_ride_share.source.address_dict()
+    segment_dict["dest"] = bing_ride_share.dest.address_dict()
+
+    segment_dict["start_time"] = bing_ride_share.time_requested.date_time_str
+    segment_dict["end_time"] = (bing_ride_share.time_requested + bing_ride_share.duration).date_time_str
+
+    segment_dict["cost"] = bing_ride_share.fare
+    segment_dict["description"] = "Use {} (factor in pickup/drop time).".format(bing_ride_share.type)
+
+    result = {
+        "segments": [segment_dict],
+        "cost": segment_dict["cost"],
+        "start": segment_dict["start"],
+        "dest": segment_dict["dest"],
+        "start_time": segment_dict["start_time"],
+        "end_time": segment_dict["end_time"],
+        "duration": segment_dict["duration"],
+        "type": "only_ride_share"
+    }
+
+    return result
+
+def _process_transit_segment(bing_transit_segment):
+    segment_dict = {}
+    segment_dict["mode"] = "transit" if isinstance(bing_transit_segment, BingTransportSegment) else "walk"
+    segment_dict["duration"] = bing_transit_segment.duration.total_seconds()
+
+
+    if isinstance(bing_transit_segment, BingTransportSegment):
+        segment_dict["start"] = bing_transit_segment.depart_details.coords.address_dict()
+        segment_dict["dest"] = bing_transit_segment.arrive_details.coords.address_dict()
+    else:
+        segment_dict["start"] = bing_transit_segment.start_location.address_dict()
+        segment_dict["dest"] = None
+
+    if isinstance(bing_transit_segment, BingTransportSegment):
+        segment_dict["start_time"] = bing_transit_segment.depart_details.time.date_time_str
+        segment_dict["end_time"] = bing_transit_segment.arrive_details.time.date_time_str
+    else:
+        segment_dict["start_time"] = None
+        segment_dict["end_time"] = None
+
+    segment_dict["cost"] = bing_transit_segment.cost
+    segment_dict["description"] = bing_transit_segment.text
+    return segment_dict
+
+def _process_transit_route(bing_transit_route):
+    segments = []
+
+    for seg in bing_transit_route.segments:
+        segments.append(_process_transit_segment(seg))
+
+    result = {
+        "segments": segments,
+        "cost": bing_transit_route.fare,
+        "start": bing_transit_route.start_location.address_dict(),
+        "dest": bing_transit_route.end_location.address_dict(),
+        "start_time": bing_transit_route.start_time.date_time_str,
+        "end_time": bing_transit_route.end_time.date_time_str,
+        "duration": bing_transit_route.duration.total_seconds(),
+        "type": "only_transit"
+    }
+
+    return result
+
+def _process_complex_route(bing_complex_route):
+    total_duration = 0.0
+    total_fare = 0
+    segments = []
+
+    complex_routes = []
+
+    for route in bing_complex_route.routes:
+        if isinstance(route, BingTransitRoute):
+            route = _process_transit_route(route)
         else:
-            segment_dict["start_time"] = None
-            segment_dict["end_time"] = None
-
-        segment_dict["cost"] = bing_transit_segment.cost
-        segment_dict["description"] = bing_transit_segment.text
-        return segment_dict
-
-    def _process_transit_route(self, bing_transit_route):
-        segments = []
-
-        for seg in bing_transit_route.segments:
-            segments.append(self._process_transit_segment(seg))
-
-        result = {
-            "segments": segments,
-            "cost": bing_transit_route.fare,
-            "start": bing_transit_route.start_location.address_dict(),
-            "dest": bing_transit_route.end_location.address_dict(),
-            "start_time": bing_transit_route.start_time.date_time_str,
-            "end_time": bing_transit_route.end_time.date_time_str,
-            "duration": bing_transit_route.duration.total_seconds(),
-            "type": "only_transit"
-        }
-
-        return result
-
-    def _process_complex_route(self, bing_complex_route):
-        total_duration = 0.0
-        total_fare = 0
-        segments = []
-
-        complex_routes = []
-
-        for route in bing_complex_route.routes:
-            if isinstance(route, BingTransitRoute):
-                route = self._process_transit_route(route)
-            else:
-                route = self._process_ride_share_route(route)
-
-            total_duration += route["duration"]
-            total_fare += route["cost"]
-            segments.extend(route['segments'])
-
-            # add the route_dict
-            complex_routes.append(route)
-
-
-        start_location = complex_routes[0]["start"]
-        dest_location = complex_routes[-1]["dest"]
-
-        start_time = complex_routes[0]["start_time"]
-        end_time = complex_routes[-1]["end_time"]
-
-        assert_equals_or_warn(start_location, segments[0]["start"])
-        assert_equals_or_warn(dest_location, segments[-1]["dest"])
-        assert_equals_or_warn(start_time, segments[0]["start_time"])
-        assert_equals_or_warn(end_time, segments[-1]["end_time"])
-        assert_equals_or_warn(total_duration, bing_complex_route.total_duration.total_seconds())
-
-
-        result = {
-            "start": start_location,
-            "dest": dest_location,
-            "start_time": start_time,
-            "end_time": end_time,
-            "cost": total_fare,
-            "duration": total_duration,
-            "segments": segments,
-            "type": "complex"
-        }
-
-        return result
+            route = _process_ride_share_route(route)
+
+        total_duration += route["duration"]
+        total_fare += route["cost"]
+        segments.extend(route['segments'])
+
+        # add the route_dict
+        complex_routes.append(route)
+
+
+    start_location = complex_routes[0]["start"]
+    dest_location = complex_routes[-1]["dest"]
+
+    start_time = complex_routes[0]["start_time"]
+    end_time = complex_routes[-1]["end_time"]
+
+    assert_equals_or_warn(start_location, segments[0]["start"])
+    assert_equals_or_warn(dest_location, segments[-1]["dest"])
+    assert_equals_or_warn(start_time, segments[0]["start_time"])
+    assert_equals_or_warn(end_time, segments[-1]["end_time"])
+    assert_equals_or_warn(total_duration, bing_complex_route.total_duration.total_seconds())
+
+
+    result = {
+        "start": start_location,
+        "dest": dest_location,
+        "start_time": start_time,
+        "end_time": end_time,
+        "cost": total_fare,
+        "duration": total_duration,
+        "segments": segments,
+        "type": "complex"
+    }
+
+    return result
+
+
+def _shift_response_list(response_list, computed_at, now=None):
+    """
+    Adapt a cached response list to a request made at `now`. Rideshares and walks are started when the user
+    asks, so their times move with the request. Transit schedules do not move: transit and hybrid routes with a
+    transit ride start at `now` and keep their arrival time, or are dropped if their first ride can no longer
+    be caught.
+
+    :param response_list: route dicts returned by Recommendations.post at `computed_at`
+    :type computed_at: datetime.datetime
+    :return: shifted copy of the response list, None if it had transit routes and none of them can still be taken
+    """
+    now = (now or datetime.datetime.now()).replace(microsecond=0)
+    delta = now - computed_at.replace(microsecond=0)
+    if delta <= datetime.timedelta(0):
+        return response_list
+
+    shifted_list = []
+    for route in response_list:
+        latest_departure = None if route["type"] == "only_ride_share" else _get_latest_departure(route)
+        if latest_departure is None:
+            shifted_list.append(_shift_route_times(route, delta))
+        elif latest_departure >= now:
+            shifted = dict(route)
+            shifted["start_time"] = BingDateTime(now).date_time_str
+            shifted["duration"] = (BingDateTime.from_date_time_str(route["end_time"]).date_time - now).total_seconds()
+            shifted_list.append(shifted)
+
+    had_transit = any(route["type"] == "only_transit" for route in response_list)
+    if had_transit and not any(route["type"] == "only_transit" for route in shifted_list):
+        return None
+    return shifted_list
+
+
+def _shift_time_str(date_time_str, delta):
+    if date_time_str is None:
+        return None
+    return (BingDateTime.from_date_time_str(date_time_str) + delta).date_time_str
+
+
+def _shift_route_times(route, delta):
+    shifted = dict(route)
+    shifted["start_time"] = _shift_time_str(route["start_time"], delta)
+    shifted["end_time"] = _shift_time_str(route["end_time"], delta)
+    shifted["segments"] = []
+    for segment in route["segments"]:
+        segment = dict(segment)
+        segment["start_time"] = _shift_time_str(segment["start_time"], delta)
+        segment["end_time"] = _shift_time_str(segment["end_time"], delta)
+        shifted["segments"].append(segment)
+    return shifted
+
+
+def _get_latest_departure(route):
+    """
+    :return: latest time the route can be started at to catch its first transit ride, None if it has none
+    :rtype: datetime.datetime
+    """
+    walk_duration = 0
+    for segment in route["segments"]:
+        if segment["mode"] == "transit":
+            depart_time = BingDateTime.from_date_time_str(segment["start_time"]).date_time
+            return depart_time - datetime.timedelta(seconds=walk_duration)
+        walk_duration += segment["duration"]
+    return None
+
+
+def _rank_routes(transit_dicts, uber_route_dict, lyft_route_dict, complex_dicts, max_routes=None,
+                 optimisation_type="time"):
+    """
+    :param max_routes: maximum number of hybrid routes, all of them if None
+    :param optimisation_type: objective the hybrid routes are sorted by, one of ranking.OBJECTIVES
+    :return: the transit routes, the rideshare routes, then the hybrid routes on the cost/duration Pareto front
+             of all the routes, best first
+    """
+    candidates = [(complex_dict["duration"], complex_dict["cost"], index)
+                  for index, complex_dict in enumerate(complex_dicts)
+                  if _filter_routes_with_only_walk_rideshare(complex_dict)]
+    ranked = ranking.rank_routes(candidates, _get_route_records(transit_dicts, uber_route_dict, lyft_route_dict),
+                                 optimisation_type, max_routes)
+
+    response_list = list(transit_dicts)
+    response_list.append(uber_route_dict)
+    response_list.append(lyft_route_dict)
+    response_list.extend(complex_dicts[index] for index in ranked)
+    return response_list
+
+
+def _get_route_records(transit_dicts, uber_route_dict, lyft_route_dict):
+    """
+    :return: (duration, cost) of the routes that are always recommended
+    """
+    return [(route_dict["duration"], route_dict["cost"])
+            for route_dict in list(transit_dicts) + [uber_route_dict, lyft_route_dict]]
+
+
+def _has_transit_ride(bing_complex_route):
+    return any(isinstance(segment, BingTransportSegment)
+               for route in bing_complex_route.routes if isinstance(route, BingTransitRoute)
+               for segment in route.segments)
 
 
 def _filter_routes_with_only_walk_rideshare(complex_route):